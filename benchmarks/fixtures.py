@@ -0,0 +1,165 @@
+import random
+import numpy as np
+import pandas as pd
+
+# Name parts for synthetic companies and drugs; combinations give plenty of distinct names
+COMPANY_STEMS = ["Acu", "Bio", "Cela", "Dara", "Exo", "Fora", "Gen", "Helio", "Immu", "Juno", "Kura", "Lumi",
+                 "Mira", "Nova", "Onco", "Pyra", "Quan", "Rhea", "Sera", "Tera", "Uni", "Vira", "Xeno", "Zyma"]
+COMPANY_ENDINGS = ["gen", "cyte", "thera", "vance", "nix", "sana", "lytix", "mune", "core", "via"]
+COMPANY_SUFFIXES = ["Therapeutics, Inc.", "Pharmaceuticals Inc", "Biosciences", "Inc.", "Corp", "N.V.", "plc"]
+DRUG_STEMS = ["ada", "beli", "cari", "dena", "eli", "fosa", "gali", "imi", "lira", "mepo", "nira", "ocre",
+              "pemb", "rituxi", "sema", "tofa", "ustek", "vedo", "zanu", "zeno"]
+DRUG_ENDINGS = ["mab", "tinib", "parib", "glutide", "lisib", "ciclib", "zumab", "ximab", "stat", "vir"]
+PHASES = [["PHASE1"], ["PHASE2"], ["PHASE3"], ["PHASE1", "PHASE2"], ["PHASE2", "PHASE3"], ["PHASE4"]]
+NON_DRUG_INTERVENTIONS = [("DEVICE", "Infusion pump"), ("BEHAVIORAL", "Exercise program"), ("DRUG", "Placebo")]
+
+
+def make_companies(n, seed=0):
+    """
+    Distinct company names as they appear in the stock lookup (company_ct)
+    """
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < n:
+        stem = rng.choice(COMPANY_STEMS) + rng.choice(COMPANY_ENDINGS)
+        if len(names) >= len(COMPANY_STEMS) * len(COMPANY_ENDINGS):
+            stem += " " + rng.choice(COMPANY_STEMS)
+        names.add(f"{stem} {rng.choice(COMPANY_SUFFIXES)}")
+    return sorted(names)
+
+
+def fda_sponsor_name(company, rng):
+    """
+    How drugsfda tends to spell a company: upper case, suffix punctuation dropped or changed
+    """
+    name = company.upper().replace(",", "")
+    if rng.random() < 0.3:
+        name = name.replace(" INC.", " INC").replace(" CORP", " CORPORATION")
+    return name
+
+
+def make_drugs(n, seed=0):
+    """
+    Drugs as (brand, ingredient, code name), with biologics carrying the FDA four-letter suffix
+    """
+    rng = random.Random(seed)
+    drugs = []
+    seen = set()
+    while len(drugs) < n:
+        ingredient = rng.choice(DRUG_STEMS) + rng.choice(DRUG_STEMS[::-1])[:3] + rng.choice(DRUG_ENDINGS)
+        if ingredient in seen:
+            ingredient += rng.choice(DRUG_STEMS)[:2]
+            if ingredient in seen:
+                continue
+        seen.add(ingredient)
+        brand = (ingredient[:3] + rng.choice(DRUG_STEMS)[:4]).upper()
+        code_name = f"{ingredient[:2].upper()}-{rng.randint(100, 9999)}"
+        fda_ingredient = ingredient + "-" + "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(4)) \
+            if ingredient.endswith("mab") else ingredient
+        drugs.append({"brand": brand, "ingredient": ingredient, "fda_ingredient": fda_ingredient, "code_name": code_name})
+    return drugs
+
+
+def _date(rng, start_year=2005, end_year=2024, fmt="%Y-%m-%d"):
+    day = pd.Timestamp(f"{start_year}-01-01") + pd.Timedelta(days=rng.randint(0, (end_year - start_year) * 365))
+    return day.strftime(fmt)
+
+
+def make_ct_docs(n, companies, drugs, seed=0):
+    """
+    Studies shaped like the v2 API: protocolSection (ids, sponsor, interventions, phases, dates)
+    and derivedSection MeSH terms. Yields documents so 1M trials can be written in batches
+    without sitting in memory at once; the same seed regenerates the same documents.
+    """
+    rng = random.Random(seed)
+    for i in range(n):
+        company = rng.choice(companies)
+        interventions = []
+        for drug in rng.sample(drugs, k=rng.choice([1, 1, 1, 2])):
+            interventions.append({
+                "type": "DRUG",
+                "name": rng.choice([drug["ingredient"].title(), drug["code_name"], drug["brand"] + "®"]),
+                "otherNames": rng.sample([drug["ingredient"], drug["code_name"], drug["brand"]], k=rng.randint(0, 2))
+            })
+        if rng.random() < 0.3:
+            kind, name = rng.choice(NON_DRUG_INTERVENTIONS)
+            interventions.append({"type": kind, "name": name})
+
+        # Real data mixes month and day precision
+        first_posted = _date(rng, fmt=rng.choice(["%Y-%m-%d", "%Y-%m"]))
+        yield {
+            "protocolSection": {
+                "identificationModule": {"nctId": f"NCT{i:08d}", "briefTitle": f"Study {i} of {interventions[0]['name']}"},
+                "sponsorCollaboratorsModule": {
+                    "leadSponsor": {"name": company, "class": "INDUSTRY"},
+                    "collaborators": [{"name": c, "class": "INDUSTRY"} for c in rng.sample(companies, k=rng.choice([0, 0, 1, 2]))]
+                },
+                "armsInterventionsModule": {"interventions": interventions},
+                "designModule": {"phases": rng.choice(PHASES)},
+                "statusModule": {
+                    "overallStatus": rng.choice(["COMPLETED", "RECRUITING", "TERMINATED"]),
+                    "studyFirstPostDateStruct": {"date": first_posted},
+                    "lastUpdatePostDateStruct": {"date": _date(rng, 2020, 2025)}
+                }
+            },
+            "derivedSection": {
+                "interventionBrowseModule": {"meshes": [{"id": f"D{rng.randint(0, 999999):06d}", "term": interventions[0]["name"].lower()}]}
+            }
+        }
+
+
+def make_fda_docs(n, companies, drugs, seed=0):
+    """
+    drugsfda application records as loaded into openfda.drugs, plus company_ct as filter_fda tags them
+    """
+    rng = random.Random(seed)
+    for i in range(n):
+        company = rng.choice(companies)
+        drug = rng.choice(drugs)
+        is_biologic = drug["fda_ingredient"] != drug["ingredient"]
+        yield {
+            "application_number": f"{'BLA' if is_biologic else 'NDA'}{i:06d}",
+            "sponsor_name": fda_sponsor_name(company, rng),
+            "products": [{
+                "product_number": f"{p + 1:03d}",
+                "brand_name": drug["brand"],
+                "active_ingredients": [{"name": drug["fda_ingredient"].upper(), "strength": f"{rng.choice([5, 10, 50, 100])}MG"}]
+            } for p in range(rng.randint(1, 3))],
+            "openfda": {"generic_name": [drug["fda_ingredient"].upper()], "substance_name": [drug["fda_ingredient"].upper()]},
+            "submissions": [
+                {"submission_type": "SUPPL", "submission_status_date": _date(rng, fmt="%Y%m%d")},
+                {"submission_type": "ORIG", "submission_status_date": _date(rng, fmt="%Y%m%d")}
+            ],
+            "company_ct": company
+        }
+
+
+def make_prices(companies, start="2005-01-01", end="2024-12-31", seed=0):
+    """
+    Business-day closing prices per company as a random walk, in the price store's long format
+    """
+    rng = np.random.default_rng(seed)
+    days = pd.bdate_range(start, end)
+    frames = []
+    for i, company in enumerate(companies):
+        walk = 20 * np.exp(np.cumsum(rng.normal(0, 0.02, len(days))))
+        frames.append(pd.DataFrame({
+            "date_stock": days,
+            "company_ct": company,
+            "ticker": f"T{i:04d}",
+            "closing_price": walk.round(2)
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def make_events(n, companies, seed=0):
+    """
+    (company, ct_date, fda_date) rows like filtered_drugs.parquet for the event window computation
+    """
+    rng = np.random.default_rng(seed)
+    ct_dates = pd.Timestamp("2006-01-01") + pd.to_timedelta(rng.integers(0, 15 * 365, n), unit="D")
+    return pd.DataFrame({
+        "fda_company": rng.choice(companies, n),
+        "ct_date": ct_dates,
+        "fda_date": ct_dates + pd.to_timedelta(rng.integers(30, 4 * 365, n), unit="D")
+    })
@@ -0,0 +1,343 @@
+import os
+import sys
+import json
+import time
+import glob
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+from datetime import datetime
+from itertools import islice
+import pyarrow.parquet as pq
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+from benchmarks import fixtures
+from utils.instrumentation import memory_watch
+from utils.drug_synonyms import normalize_name
+
+RESULTS_DIR = os.path.join(ROOT_DIR, "benchmarks", "results")
+BENCHMARK_DB = "bootstrap_benchmarks"  # Scratch database when benchmarking against a real MongoDB
+TRIALS_PER_APPLICATION = 10
+TRIALS_PER_COMPANY = 200
+MAX_DRUGS = 2000
+CT_PAGE_SIZE = 1000  # Same page size as the clinicaltrials.gov loader
+EVENTS_PER_TRIAL = 0.1
+INSERT_BATCH = 10_000  # Generated documents held at once while filling a collection
+REGRESSION_TOLERANCE = 0.2  # Slower than the baseline by more than this fraction counts as a regression
+
+
+def connect(mongo):
+    """
+    A MongoDB client: mongomock's in-memory stand-in for 'mock', otherwise a real server at the given URI
+    """
+    if mongo == "mock":
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("The in-memory stand-in needs mongomock (pip install mongomock), or pass --mongo <uri>")
+        return mongomock.MongoClient()
+    from pymongo import MongoClient
+    return MongoClient(mongo)
+
+
+def timed(func, repeat):
+    """
+    Run func `repeat` times; returns the last result and the best/median wall times
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return result, {"best_seconds": round(min(times), 4), "median_seconds": round(statistics.median(times), 4)}
+
+
+def timed_batches(make_batches, write, repeat):
+    """
+    Like timed, but only the writes count: each repeat regenerates its batches between them
+    """
+    times = []
+    for _ in range(repeat):
+        elapsed = 0
+        for batch in make_batches():
+            start = time.perf_counter()
+            write(batch)
+            elapsed += time.perf_counter() - start
+        times.append(elapsed)
+    return {"best_seconds": round(min(times), 4), "median_seconds": round(statistics.median(times), 4)}
+
+
+def batches(docs, size):
+    return iter(lambda: list(islice(docs, size)), [])
+
+
+def build_fixtures(trials, seed):
+    """
+    Companies and drugs, plus functions that regenerate the trial and application documents from the seed,
+    so a benchmark streams them instead of holding 1M trials in memory
+    """
+    companies = fixtures.make_companies(max(20, trials // TRIALS_PER_COMPANY), seed)
+    drugs = fixtures.make_drugs(min(MAX_DRUGS, max(50, trials // 20)), seed)
+    applications = max(10, trials // TRIALS_PER_APPLICATION)
+    return {
+        "companies": companies,
+        "drugs": drugs,
+        "trials": trials,
+        "applications": applications,
+        "ct_docs": lambda: fixtures.make_ct_docs(trials, companies, drugs, seed),
+        "fda_docs": lambda: fixtures.make_fda_docs(applications, companies, drugs, seed)
+    }
+
+
+def insert_docs(collection, docs):
+    for batch in batches(docs, INSERT_BATCH):
+        collection.insert_many(batch)
+
+
+def bench_normalize_name(data, repeat):
+    names = [
+        intervention["name"]
+        for doc in data["ct_docs"]()
+        for intervention in doc["protocolSection"]["armsInterventionsModule"]["interventions"]
+    ]
+    names += [p["brand_name"] for doc in data["fda_docs"]() for p in doc["products"]]
+    _, result = timed(lambda: [normalize_name(name) for name in names], repeat)
+    result["rows"] = len(names)
+    return result
+
+
+def bench_combine(data, client, repeat):
+    """
+    combine_fda_and_ct against the stand-in: a cold run (building the name index), a warm run
+    (reusing it) and a run through the synonym table
+    """
+    from data_cleaning import combine_fda_and_ct as combine
+
+    db = client[BENCHMARK_DB]
+    db.ct_stocks_filter.drop()
+    db.fda_stocks_filter.drop()
+    insert_docs(db.ct_stocks_filter, data["ct_docs"]())
+    insert_docs(db.fda_stocks_filter, data["fda_docs"]())
+    combine.ct_collection = db.ct_stocks_filter
+    combine.fda_collection = db.fda_stocks_filter
+
+    # The script writes relative to the repo root; keep its files out of the real processed_data
+    work_dir = tempfile.mkdtemp(prefix="bootstrap_bench_")
+    os.makedirs(os.path.join(work_dir, "data_cleaning", "processed_data"))
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        _, cold = timed(lambda: combine.combine_fda_and_ct(rebuild_index=True), repeat)
+        _, warm = timed(lambda: combine.combine_fda_and_ct(), repeat)
+        _, synonyms = timed(lambda: combine.combine_fda_and_ct(use_synonyms=True, rebuild_index=True), repeat)
+        matched_rows = pq.read_metadata(combine.COMBINED_PATH).num_rows
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir)
+        db.ct_stocks_filter.drop()
+        db.fda_stocks_filter.drop()
+
+    return {
+        "cold_index": dict(cold, rows=data["trials"]),
+        "warm_index": dict(warm, rows=data["trials"]),
+        "synonyms": dict(synonyms, rows=data["trials"], matched_rows=matched_rows)
+    }
+
+
+def bench_filter_fda(data, repeat, threshold=95):
+    from data_cleaning.filter_fda import match_sponsors
+
+    sponsor_names = sorted({doc["sponsor_name"] for doc in data["fda_docs"]()})
+    matches, result = timed(lambda: match_sponsors(sponsor_names, data["companies"], threshold), repeat)
+    result.update(rows=len(sponsor_names), companies=len(data["companies"]), matched=len(matches))
+    return result
+
+
+def bench_event_windows(data, trials, repeat):
+    from viz.make_graphs import build_price_index, compute_event_prices
+
+    stocks = fixtures.make_prices(data["companies"])
+    events = fixtures.make_events(max(100, int(trials * EVENTS_PER_TRIAL)), data["companies"])
+    price_index, build = timed(lambda: build_price_index(stocks), repeat)
+    _, compute = timed(lambda: compute_event_prices(price_index, events), repeat)
+    return {
+        "build_price_index": dict(build, rows=len(stocks)),
+        "compute_event_prices": dict(compute, rows=len(events))
+    }
+
+
+def bench_mongo_load(data, client, repeat):
+    """
+    Insert throughput of the two loaders' write paths: clinical trial pages and FDA record chunks.
+    Pages are generated as they are written; only the writes are timed.
+    """
+    from data_ingest.extract_load_clinical_trials import write_page
+    from data_ingest.extract_load_fda_approvals import load_records, BATCH_SIZE
+
+    collection = client[BENCHMARK_DB]["load_benchmark"]
+
+    def ct_pages():
+        collection.drop()
+        return batches(data["ct_docs"](), CT_PAGE_SIZE)
+
+    def fda_chunks():
+        collection.drop()
+        return batches(data["fda_docs"](), BATCH_SIZE)
+
+    try:
+        ct = timed_batches(ct_pages, lambda page: write_page(collection, page), repeat)
+        fda = timed_batches(fda_chunks, lambda chunk: load_records(collection, chunk), repeat)
+    finally:
+        collection.drop()
+
+    for result, rows in ((ct, data["trials"]), (fda, data["applications"])):
+        result["rows"] = rows
+        result["rows_per_second"] = round(rows / result["best_seconds"]) if result["best_seconds"] else None
+    return {"clinical_trials": ct, "fda": fda}
+
+
+BENCHMARKS = ["normalize_name", "combine", "filter_fda", "event_windows", "mongo_load"]
+
+
+def run_benchmarks(trials, mongo="mock", only=None, repeat=3, seed=0):
+    client = connect(mongo)
+    selected = only or BENCHMARKS
+
+    start = time.perf_counter()
+    data = build_fixtures(trials, seed)
+    print(f"Set up {data['trials']} trials, {data['applications']} applications "
+          f"and {len(data['companies'])} companies in {time.perf_counter() - start:.1f}s")
+
+    runners = {
+        "normalize_name": lambda: bench_normalize_name(data, repeat),
+        "combine": lambda: bench_combine(data, client, repeat),
+        "filter_fda": lambda: bench_filter_fda(data, repeat),
+        "event_windows": lambda: bench_event_windows(data, trials, repeat),
+        "mongo_load": lambda: bench_mongo_load(data, client, repeat)
+    }
+    results = {}
+    for name in selected:
+        print(f"Running {name}")
+        with memory_watch() as memory:
+            results[name] = runners[name]()
+        results[name]["peak_rss_mb"] = round(memory.peak_rss_mb, 1)
+        results[name]["rss_growth_mb"] = round(memory.rss_growth_mb, 1)
+
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "trials": trials,
+        "seed": seed,
+        "repeat": repeat,
+        "mongo": "mock" if mongo == "mock" else "server",
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "results": results
+    }
+
+
+def flatten_timings(results, prefix=""):
+    """
+    {"combine.cold_index": best_seconds, ...} for every timed entry
+    """
+    timings = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            if "best_seconds" in value:
+                timings[prefix + key] = value["best_seconds"]
+            else:
+                timings.update(flatten_timings(value, prefix + key + "."))
+    return timings
+
+
+def find_baseline(report):
+    """
+    The newest saved run at the same scale and Mongo backend
+    """
+    for path in sorted(glob.glob(os.path.join(RESULTS_DIR, "*.json")), reverse=True):
+        with open(path, "r") as f:
+            candidate = json.load(f)
+        if candidate.get("trials") == report["trials"] and candidate.get("mongo") == report["mongo"]:
+            return path, candidate
+    return None, None
+
+
+def compare(report, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Print each timing against the baseline and return the names that slowed down past the tolerance
+    """
+    current = flatten_timings(report["results"])
+    previous = flatten_timings(baseline["results"])
+    regressions = []
+    for name, seconds in current.items():
+        if name not in previous or not previous[name]:
+            print(f"  {name:45s} {seconds:9.4f}s  (new)")
+            continue
+        change = seconds / previous[name] - 1
+        flag = ""
+        if change > tolerance:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        print(f"  {name:45s} {seconds:9.4f}s  {change:+7.1%} vs {previous[name]:.4f}s{flag}")
+    return regressions
+
+
+def save_report(report, label=None):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(RESULTS_DIR, f"{stamp}-{label or report['trials']}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark matching, filtering, event windows and Mongo loads on synthetic data')
+    parser.add_argument('--trials', type=int, default=10_000,
+                        help='Synthetic clinical trials to generate (applications and companies scale with it)')
+    parser.add_argument('--mongo', default='mock',
+                        help="'mock' for the in-memory mongomock stand-in, or a MongoDB URI (uses a scratch database)")
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS,
+                        help='Run just these benchmarks')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs per benchmark; the best time is compared')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed for the synthetic data')
+    parser.add_argument('--baseline',
+                        help='Results file to compare against (default: newest saved run at the same scale)')
+    parser.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE,
+                        help='Allowed slowdown before a timing counts as a regression, eg 0.2 for 20%%')
+    parser.add_argument('--label',
+                        help='Name to save this run under in benchmarks/results/')
+    parser.add_argument('--no-save', action='store_true',
+                        help="Compare only, don't save this run")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.trials, mongo=args.mongo, only=args.only, repeat=args.repeat, seed=args.seed)
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline_path, baseline = args.baseline, json.load(f)
+    else:
+        baseline_path, baseline = find_baseline(report)
+
+    regressions = []
+    if baseline:
+        print(f"Compared with {baseline_path}:")
+        regressions = compare(report, baseline, args.tolerance)
+    else:
+        for name, seconds in flatten_timings(report["results"]).items():
+            print(f"  {name:45s} {seconds:9.4f}s")
+
+    if not args.no_save:
+        print("Saved results to", save_report(report, args.label))
+
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
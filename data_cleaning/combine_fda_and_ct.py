@@ -1,99 +1,417 @@
-import re
-import csv
+import os
+import json
+import zlib
+import shutil
+import heapq
+import hashlib
+import tempfile
+import argparse
+import multiprocessing
+from contextlib import contextmanager
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pymongo import MongoClient
 
+from utils.drug_synonyms import normalize_name, build_synonym_table, drug_key, NORMALIZER_VERSION
+from utils.instrumentation import stage
+from utils.field_paths import compile_path, compile_fields, projection
+from utils.helpers import parse_partial_dates
+
 # MongoDB connection details
 mongo_uri = "mongodb://localhost:27017/"
 clinical_trials_db = "clinical_trials_db"
 openfda_db = "openfda"
 filtered_coll = "stocks_filter"
+FDA_NAME_INDEX_PATH = "./data_cleaning/processed_data/fda_name_index.json"
+DRUG_SYNONYMS_PATH = "./data_cleaning/processed_data/drug_synonyms.json"
+COMBINED_PATH = "./data_cleaning/processed_data/combine_fda_and_ct.parquet"
+CT_SPONSOR_FIELD = "protocolSection.sponsorCollaboratorsModule.leadSponsor.name"
+SHARDS_PER_WORKER = 4  # More shards than workers keeps every core busy when sponsor sizes are skewed
+WRITE_BATCH_ROWS = 50_000  # Matched rows held before they are written out as one parquet row group
+PART_READ_ROWS = 5_000  # Rows read at a time from each shard part while merging
+NAME_INDEX_VERSION = 1  # Bump when the layout of the saved name index or synonym table changes
+
+# Matched pairs are stored typed: real list columns and dates, so downstream steps don't re-parse strings
+LIST_COLUMNS = ['matched_drug_names', 'ct_phase', 'fda_brand', 'fda_generic', 'fda_active', 'ct_name', 'ct_otherNames', 'normalized_fda_drug_names']
+MATCH_SCHEMA = pa.schema(
+    [("ct_id", pa.string()), ("fda_id", pa.string()), ("fda_company", pa.string())]
+    + [("matched_drug_names", pa.list_(pa.string()))]
+    + [("ct_date", pa.timestamp("ns")), ("fda_date", pa.timestamp("ns"))]
+    + [(column, pa.list_(pa.string())) for column in LIST_COLUMNS[1:]]
+    + [("ct_date_precision", pa.string())]  # "month" for YYYY-MM trial dates, which sit on the 1st
+)
+MATCH_COLUMNS = MATCH_SCHEMA.names[:-1]  # Row layout; matches_table derives ct_date_precision
 
 # Build FDA map
 client = MongoClient(mongo_uri)
 ct_collection = client[clinical_trials_db][filtered_coll]
 fda_collection = client[openfda_db][filtered_coll]
 
-# Normalize function: lowercase, remove trademarks/copyright symbols, strip whitespace, and split combined names
-def normalize_name(name: str) -> list:
-    name = name.lower()
-    name = re.sub(r'[\u00ae\u2122\u00a9]', '', name)  # Remove symbols: ® = ®, ™ = ™, © = ©
-    name = name.strip()
-    # Split names by " and " or "/"
-    split_names = re.split(r'\s+and\s+|/', name)
-    return [n.strip() for n in split_names if n.strip()]
-
 # Dynamic field configuration (add new fields here as needed)
+# Dotted paths, compiled once by utils/field_paths.py; [] expands a list, [key=value] takes the first match
 FIELD_CONFIG = {
     "ct_fields": {
-        "ct_name": lambda doc: [intervention.get("name", "") for intervention in doc.get("protocolSection", {}).get("armsInterventionsModule", {}).get("interventions", [])],
-        "ct_otherNames": lambda doc: [name for intervention in doc.get("protocolSection", {}).get("armsInterventionsModule", {}).get("interventions", []) for name in intervention.get("otherNames", [])],
-        "ct_sponsor": lambda doc: doc.get("protocolSection", {}).get("sponsorCollaboratorsModule", {}).get("leadSponsor", {}).get("name", ""),
-        "ct_id": lambda doc: doc.get("protocolSection", {}).get("identificationModule", {}).get("nctId", ""),
-        "ct_phase": lambda doc: doc.get("protocolSection", {}).get("designModule", {}).get("phases", ""),
-        "ct_date": lambda doc: doc.get("protocolSection", {}).get("statusModule", {}).get("studyFirstPostDateStruct", {}).get("date", "")
+        "ct_name": "protocolSection.armsInterventionsModule.interventions[].name",
+        "ct_otherNames": "protocolSection.armsInterventionsModule.interventions[].otherNames[]",
+        "ct_interventions": "protocolSection.armsInterventionsModule.interventions[]",
+        "ct_sponsor": CT_SPONSOR_FIELD,
+        "ct_id": "protocolSection.identificationModule.nctId",
+        "ct_phase": "protocolSection.designModule.phases",
+        "ct_date": "protocolSection.statusModule.studyFirstPostDateStruct.date"
     },
     "fda_fields": {
-        "fda_brand": lambda doc: [p.get("brand_name", "") for p in doc.get("products", [])],
-        "fda_generic": lambda doc: doc.get("openfda", {}).get("generic_name", []),
-        "fda_active": lambda doc: [ingredient.get("name", "") for p in doc.get("products", []) for ingredient in p.get("active_ingredients", [])],
-        "fda_company": lambda doc: doc.get("company_ct", ""),
-        "fda_id": lambda doc: doc.get("application_number", ""),
-        "fda_date": lambda doc: next((sub.get("submission_status_date", "") for sub in doc.get("submissions", []) if sub.get("submission_type") == "ORIG"), "")
+        "fda_brand": "products[].brand_name",
+        "fda_generic": "openfda.generic_name[]",
+        "fda_active": "products[].active_ingredients[].name",
+        "fda_company": "company_ct",
+        "fda_id": "application_number",
+        "fda_date": "submissions[submission_type=ORIG].submission_status_date"
     }
 }
+CT_LAST_UPDATE_FIELD = "protocolSection.statusModule.lastUpdatePostDateStruct.date"
+
+# Each document is walked once into a {field: value} record, reading only the projected fields
+extract_ct = compile_fields(FIELD_CONFIG['ct_fields'])
+extract_fda = compile_fields(FIELD_CONFIG['fda_fields'])
+CT_PROJECTION = projection(FIELD_CONFIG['ct_fields'].values())
+FDA_PROJECTION = projection(FIELD_CONFIG['fda_fields'].values())
+
+def collection_fingerprint(collection, field):
+    """
+    Hash of the (_id, field) pairs in a collection, cheap to compute with a projection.
+    The filter steps rebuild these collections, so a changed fingerprint means a derived file is stale.
+    """
+    getter = compile_path(field)
+    digest = hashlib.sha256()
+    for doc in collection.find({}, {"_id": 1, field: 1}).sort("_id", 1):
+        digest.update(f"{doc['_id']}|{getter(doc)}\n".encode())
+    return digest.hexdigest()
+
+def index_version():
+    """
+    What the saved index files were built with besides the data: their layout, the name normalizer
+    and the extracted FDA fields, so a code change rebuilds them without --rebuild-index
+    """
+    fields = json.dumps(FIELD_CONFIG['fda_fields'], sort_keys=True)
+    return f"v{NAME_INDEX_VERSION}|normalizer v{NORMALIZER_VERSION}|{hashlib.sha256(fields.encode()).hexdigest()}|"
+
+def fda_collection_fingerprint():
+    return collection_fingerprint(fda_collection, FIELD_CONFIG['fda_fields']['fda_company'])
+
+def ct_collection_fingerprint():
+    return collection_fingerprint(ct_collection, CT_LAST_UPDATE_FIELD)
+
+def build_fda_name_index():
+    """
+    Extract FIELD_CONFIG and normalize_name once per FDA application and build an
+    inverted index from each normalized drug name to the applications carrying it
+    """
+    applications = []
+    names_index = {}
+    for fda_doc in fda_collection.find({}, FDA_PROJECTION):
+        fda = extract_fda(fda_doc)
+        fda_drug_names = set(fda["fda_brand"] + fda["fda_generic"] + fda["fda_active"])
+        normalized_fda_drug_names = sorted({n for name in fda_drug_names for n in normalize_name(name)})
+
+        position = len(applications)
+        applications.append({
+            "fda_id": fda["fda_id"],
+            "fda_company": fda["fda_company"],
+            "fda_date": fda["fda_date"],
+            "fda_brand": fda["fda_brand"],
+            "fda_generic": fda["fda_generic"],
+            "fda_active": fda["fda_active"],
+            "normalized_fda_drug_names": normalized_fda_drug_names
+        })
+        for name in normalized_fda_drug_names:
+            names_index.setdefault(name, []).append(position)
+
+    return {"applications": applications, "names": names_index}
+
+def load_fda_name_index(rebuild=False):
+    """
+    Reuse the saved index while the filtered FDA collection and index_version are unchanged, otherwise rebuild and save it
+    """
+    fingerprint = index_version() + fda_collection_fingerprint()
+    if not rebuild and os.path.exists(FDA_NAME_INDEX_PATH):
+        with open(FDA_NAME_INDEX_PATH, "r") as f:
+            index = json.load(f)
+        if index.get("fingerprint") == fingerprint:
+            print(f"Reusing FDA drug name index from {FDA_NAME_INDEX_PATH}")
+            return index
+
+    print("Building FDA drug name index")
+    index = build_fda_name_index()
+    index["fingerprint"] = fingerprint
+    with open(FDA_NAME_INDEX_PATH, "w") as f:
+        json.dump(index, f)
+    return index
+
+def load_synonym_table(rebuild=False):
+    """
+    Drug ids from the brand/ingredient/code-name synonym graph, cached until either filtered collection
+    or index_version changes
+    """
+    fingerprint = index_version() + fda_collection_fingerprint() + ct_collection_fingerprint()
+    if not rebuild and os.path.exists(DRUG_SYNONYMS_PATH):
+        with open(DRUG_SYNONYMS_PATH, "r") as f:
+            synonyms = json.load(f)
+        if synonyms.get("fingerprint") == fingerprint:
+            print(f"Reusing drug synonyms from {DRUG_SYNONYMS_PATH}")
+            return synonyms["drug_ids"]
+
+    print("Building drug synonym table")
+    drug_ids = build_synonym_table(
+        fda_collection.find({}, {"products": 1, "openfda": 1}),
+        ct_collection.find({}, {
+            "protocolSection.armsInterventionsModule": 1,
+            "protocolSection.interventionBrowseModule": 1,
+            "derivedSection.interventionBrowseModule": 1
+        })
+    )
+    with open(DRUG_SYNONYMS_PATH, "w") as f:
+        json.dump({"fingerprint": fingerprint, "drug_ids": drug_ids}, f)
+    return drug_ids
+
+def ct_drug_names(ct_interventions):
+    """
+    Normalized drug names of a trial's interventions, ignoring non-drug interventions and placebo
+    """
+    # Filter out interventions with type "DEVICE" or name "Placebo"
+    names = set()
+    for intervention in ct_interventions:
+        if intervention.get("type", "").lower() == "drug" and intervention.get("name", "").lower() != "placebo":
+            names.add(intervention.get("name", ""))
+            names.update(intervention.get("otherNames", []))
+    return {n for name in names for n in normalize_name(name)}
+
+def match_index(index, drug_ids=None):
+    """
+    Name index, name -> index key function and sponsor set used to match trials.
+    With drug_ids the name index is re-keyed by drug id.
+    """
+    applications = index["applications"]
+    names_index = index["names"]
+    key = lambda name: name
+
+    if drug_ids is not None:
+        key = lambda name: drug_key(drug_ids, name)
+        # Re-key the name index by drug id
+        id_index = {}
+        for name, positions in names_index.items():
+            id_index.setdefault(key(name), set()).update(positions)
+        names_index = {drug_id: sorted(positions) for drug_id, positions in id_index.items()}
+    fda_companies = {application["fda_company"].lower() for application in applications}
+    return applications, names_index, key, fda_companies
+
+def match_trial(ct, applications, names_index, key, fda_companies, same_sponsor=True):
+    """
+    Rows (in MATCH_COLUMNS order) for one trial record from extract_ct, one per matched FDA application in index order
+    """
+    ct_sponsor = ct["ct_sponsor"].lower()
+    if same_sponsor and ct_sponsor not in fda_companies:
+        return []
+
+    # Collect the matched names per application straight from the index
+    matches = {}
+    for name in ct_drug_names(ct["ct_interventions"]):
+        for position in names_index.get(key(name), []):
+            if same_sponsor and applications[position]["fda_company"].lower() != ct_sponsor:
+                continue
+            matches.setdefault(position, set()).add(name)
+
+    rows = []
+    for position in sorted(matches):
+        application = applications[position]
+        rows.append([
+            ct["ct_id"],
+            application["fda_id"],
+            application["fda_company"],
+            sorted(matches[position]),
+            ct["ct_date"],
+            application["fda_date"],
+            ct["ct_phase"],
+            application["fda_brand"],
+            application["fda_generic"],
+            application["fda_active"],
+            ct["ct_name"],
+            ct["ct_otherNames"],
+            application["normalized_fda_drug_names"]
+        ])
+    return rows
+
+def as_list(value):
+    """
+    A list column value; FIELD_CONFIG gives "" for a missing field
+    """
+    if isinstance(value, list):
+        return value
+    return [] if value in ("", None) else [value]
+
+def matches_table(rows):
+    """
+    Arrow table of matched rows with list columns and CT (YYYY-MM or YYYY-MM-DD) and FDA (YYYYMMDD) dates parsed once
+    """
+    df = pd.DataFrame(rows, columns=MATCH_COLUMNS)
+    for column in LIST_COLUMNS:
+        df[column] = df[column].map(as_list)
+    ct_dates = parse_partial_dates(df['ct_date'])
+    df['ct_date'] = ct_dates['date']
+    df['ct_date_precision'] = ct_dates['precision']
+    df['fda_date'] = parse_partial_dates(df['fda_date'])['date']
+    return pa.Table.from_pandas(df, schema=MATCH_SCHEMA, preserve_index=False)
+
+def shard_of(sponsor, shards):
+    """
+    Stable shard number of a lowercased sponsor, the same in every process and run
+    """
+    return zlib.crc32((sponsor or "").lower().encode()) % shards
+
+def sponsor_shards(shards, same_sponsor=True, fda_companies=()):
+    """
+    Split the trial lead sponsors (exact spellings, for an indexed $in) into shards by lowercased name.
+    With same_sponsor, sponsors without FDA applications are left out since they can't match.
+    """
+    sponsor_lists = [[] for _ in range(shards)]
+    for sponsor in ct_collection.distinct(CT_SPONSOR_FIELD):
+        if same_sponsor and (sponsor or "").lower() not in fda_companies:
+            continue
+        sponsor_lists[shard_of(sponsor, shards)].append(sponsor)
+    if not same_sponsor:
+        # Trials without a lead sponsor ($in: [None] matches a missing field)
+        sponsor_lists[0].append(None)
+    return sponsor_lists
+
+def _match_shard(shard, sponsors, part_path, same_sponsor, use_synonyms):
+    """
+    Worker process: match one shard's trials with its own Mongo cursor and write its rows,
+    sorted by (ct_id, fda_id), to a parquet part file. The parent already refreshed the index files.
+    """
+    with open(FDA_NAME_INDEX_PATH, "r") as f:
+        index = json.load(f)
+    drug_ids = None
+    if use_synonyms:
+        with open(DRUG_SYNONYMS_PATH, "r") as f:
+            drug_ids = json.load(f)["drug_ids"]
+    applications, names_index, key, fda_companies = match_index(index, drug_ids)
+
+    trials = 0
+    rows = []
+    for ct_doc in ct_collection.find({CT_SPONSOR_FIELD: {"$in": sponsors}}, CT_PROJECTION):
+        trials += 1
+        rows.extend(match_trial(extract_ct(ct_doc), applications, names_index, key, fda_companies, same_sponsor))
+    rows.sort(key=lambda row: (row[0], row[1]))
+
+    pq.write_table(matches_table(rows), part_path)
+    return shard, trials, len(rows)
+
+def part_rows(path):
+    """
+    Rows of a part file as dicts, read PART_READ_ROWS at a time
+    """
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=PART_READ_ROWS):
+        yield from batch.to_pylist()
+
+def merge_parts(part_paths, writer):
+    """
+    k-way merge of the sorted part files, so the output is the same for any number of workers.
+    Holds one read batch per part and one write batch.
+    """
+    rows = []
+    for row in heapq.merge(*(part_rows(path) for path in part_paths), key=lambda row: (row["ct_id"], row["fda_id"])):
+        rows.append(row)
+        if len(rows) >= WRITE_BATCH_ROWS:
+            writer.write_table(pa.Table.from_pylist(rows, schema=MATCH_SCHEMA))
+            rows = []
+    if rows:
+        writer.write_table(pa.Table.from_pylist(rows, schema=MATCH_SCHEMA))
+
+@contextmanager
+def combined_writer():
+    """
+    ParquetWriter for COMBINED_PATH. Batches go to a temp file that replaces the output once complete.
+    """
+    tmp_path = COMBINED_PATH + ".tmp"
+    with pq.ParquetWriter(tmp_path, MATCH_SCHEMA) as writer:
+        yield writer
+    os.replace(tmp_path, COMBINED_PATH)
+
+# Function to find matches and write them to parquet
+def combine_fda_and_ct(same_sponsor=True, rebuild_index=False, use_synonyms=False, workers=1, shards=None):
+    """
+    Match each trial's drug names against the FDA name index (one hash lookup per name).
+    By default a trial only matches applications from its own sponsor; same_sponsor=False
+    also matches licensed or acquired drugs filed by another company.
+    With use_synonyms, names are first resolved to drug ids so brand names, ingredients
+    and code names of the same drug (eg BIZENGRI / zenocutuzumab-zbco / MCLA-128) match.
+    With workers > 1, trials are split into sponsor shards matched in parallel processes.
+    Either way rows come out sorted by (ct_id, fda_id), so the output doesn't depend on the worker count.
+    """
+    index = load_fda_name_index(rebuild=rebuild_index)
+    drug_ids = load_synonym_table(rebuild=rebuild_index) if use_synonyms else None
+    if workers > 1:
+        return combine_parallel(index, same_sponsor, use_synonyms, workers, shards or workers * SHARDS_PER_WORKER)
+
+    applications, names_index, key, fda_companies = match_index(index, drug_ids)
+    with stage("combine_fda_and_ct") as metrics, combined_writer() as writer:
+        rows = []
+        # Trials in ct_id order and each trial's matches by fda_id, the order merge_parts produces
+        trials = ct_collection.find({}, CT_PROJECTION).sort(FIELD_CONFIG['ct_fields']['ct_id'], 1).allow_disk_use(True)
+        for ct_doc in trials:
+            metrics.rows_in += 1
+            trial_rows = match_trial(extract_ct(ct_doc), applications, names_index, key, fda_companies, same_sponsor)
+            rows.extend(sorted(trial_rows, key=lambda row: row[1]))
+            if len(rows) >= WRITE_BATCH_ROWS:
+                writer.write_table(matches_table(rows))
+                metrics.rows_out += len(rows)
+                rows = []
+        if rows:
+            writer.write_table(matches_table(rows))
+            metrics.rows_out += len(rows)
+
+def combine_parallel(index, same_sponsor, use_synonyms, workers, shards):
+    fda_companies = {application["fda_company"].lower() for application in index["applications"]}
+    sponsor_lists = sponsor_shards(shards, same_sponsor, fda_companies)
+    part_dir = tempfile.mkdtemp(prefix="combine_parts_", dir=os.path.dirname(COMBINED_PATH))
+    part_paths = [os.path.join(part_dir, f"part-{shard:04d}.parquet") for shard in range(shards)]
+
+    with stage("combine_fda_and_ct") as metrics:
+        try:
+            # spawn so each worker opens its own MongoClient instead of inheriting one across fork
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                futures = [
+                    executor.submit(_match_shard, shard, sponsors, part_paths[shard], same_sponsor, use_synonyms)
+                    for shard, sponsors in enumerate(sponsor_lists)
+                ]
+                for future in as_completed(futures):
+                    shard, trials, rows = future.result()
+                    metrics.rows_in += trials
+                    metrics.rows_out += rows
+                    metrics.count("shards")
+
+            with combined_writer() as writer:
+                merge_parts(part_paths, writer)
+        finally:
+            shutil.rmtree(part_dir, ignore_errors=True)
+    print(f"Matched {metrics.rows_out} trial/application pairs from {metrics.rows_in} trials in {shards} shards")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Match clinical trial interventions to FDA applications')
+    parser.add_argument('--any-sponsor', action='store_true',
+                        help='Also match drugs whose FDA application was filed by a different company')
+    parser.add_argument('--rebuild-index', action='store_true',
+                        help='Rebuild the FDA drug name index even if the FDA collection is unchanged')
+    parser.add_argument('--synonyms', action='store_true',
+                        help='Match brand names, ingredients and code names of the same drug through the synonym table')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Processes matching sponsor shards in parallel (1 keeps the single-process scan)')
+    parser.add_argument('--shards', type=int, default=None,
+                        help=f'Sponsor shards to split the trials into (default: {SHARDS_PER_WORKER} per worker)')
+    args = parser.parse_args()
 
-# Function to find matches and write to CSV
-def combine_fda_and_ct():
-    # Create a dictionary for quick lookup of FDA documents by company
-    fda_docs_by_company = {}
-    for fda_doc in fda_collection.find():
-        fda_company = FIELD_CONFIG['fda_fields']['fda_company'](fda_doc).lower()
-        if fda_company not in fda_docs_by_company:
-            fda_docs_by_company[fda_company] = []
-        fda_docs_by_company[fda_company].append(fda_doc)
-
-    with open('./data_cleaning/processed_data/combine_fda_and_ct.csv', mode='w', newline='') as file:
-        writer = csv.writer(file)
-        writer.writerow(['ct_id', 'fda_id', 'fda_company', 'matched_drug_names', 'ct_date', 'fda_date', 'ct_phase', 'fda_brand', 'fda_generic', 'fda_active', 'ct_name', 'ct_otherNames', 'normalized_fda_drug_names'])
-
-        for ct_doc in ct_collection.find():
-            ct_sponsor = FIELD_CONFIG['ct_fields']['ct_sponsor'](ct_doc).lower()
-            if ct_sponsor in fda_docs_by_company:
-                # Filter out interventions with type "DEVICE" or name "Placebo"
-                ct_interventions = ct_doc.get("protocolSection", {}).get("armsInterventionsModule", {}).get("interventions", [])
-                ct_drug_names = set()
-                for intervention in ct_interventions:
-                    if intervention.get("type", "").lower() == "drug" and intervention.get("name", "").lower() != "placebo":
-                        ct_drug_names.add(intervention.get("name", ""))
-                        ct_drug_names.update(intervention.get("otherNames", []))
-
-                normalized_ct_drug_names = {n for name in ct_drug_names for n in normalize_name(name)}
-
-                for fda_doc in fda_docs_by_company[ct_sponsor]:
-                    fda_drug_names = set(FIELD_CONFIG['fda_fields']['fda_brand'](fda_doc) + \
-                                         FIELD_CONFIG['fda_fields']['fda_generic'](fda_doc) + \
-                                         FIELD_CONFIG['fda_fields']['fda_active'](fda_doc))
-                    normalized_fda_drug_names = {n for name in fda_drug_names for n in normalize_name(name)}
-
-                    # Find intersection
-                    matched_drug_names = normalized_fda_drug_names.intersection(normalized_ct_drug_names)
-
-                    if matched_drug_names:
-                        writer.writerow([
-                            FIELD_CONFIG['ct_fields']['ct_id'](ct_doc),
-                            FIELD_CONFIG['fda_fields']['fda_id'](fda_doc),
-                            FIELD_CONFIG['fda_fields']['fda_company'](fda_doc),
-                            ', '.join(matched_drug_names),
-                            FIELD_CONFIG['ct_fields']['ct_date'](ct_doc),
-                            FIELD_CONFIG['fda_fields']['fda_date'](fda_doc),
-                            FIELD_CONFIG['ct_fields']['ct_phase'](ct_doc),
-                            FIELD_CONFIG['fda_fields']['fda_brand'](fda_doc),
-                            FIELD_CONFIG['fda_fields']['fda_generic'](fda_doc),
-                            FIELD_CONFIG['fda_fields']['fda_active'](fda_doc),
-                            FIELD_CONFIG['ct_fields']['ct_name'](ct_doc),
-                            FIELD_CONFIG['ct_fields']['ct_otherNames'](ct_doc),
-                            ', '.join(normalized_fda_drug_names)
-                        ])
-
-# Execute the function
-combine_fda_and_ct()
\ No newline at end of file
+    # Execute the function
+    combine_fda_and_ct(same_sponsor=not args.any_sponsor, rebuild_index=args.rebuild_index, use_synonyms=args.synonyms,
+                       workers=args.workers, shards=args.shards)
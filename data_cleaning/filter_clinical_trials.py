@@ -1,8 +1,9 @@
-import pandas as pd
 from pprint import pprint
 from rapidfuzz import fuzz
 from pymongo import MongoClient
 
+from utils import price_store
+
 
 # MongoDB connection details
 mongo_uri = "mongodb://localhost:27017/"
@@ -12,19 +13,23 @@ new_coll = "stocks_filter"
 
 openfda_db = "openfda"
 openfda_collection = "drugs"
+SPONSOR_FIELD = "protocolSection.sponsorCollaboratorsModule.leadSponsor.name"
 
 
-def load_stock_data(file_path):
-    return pd.read_csv(file_path)
+def load_stock_data():
+    # Only the company names are needed here, so only that column is read from the price store
+    return price_store.read_prices(columns=["company_ct"])
 
 def clean_clinical_trials_data(stock_data):
     company_list = list(stock_data['company_ct'].unique())
     print(f"Setting Up MongoDB instance to look up the", len(company_list), "unique companies in the stock dataset")
     client = MongoClient(mongo_uri)
-    client[clinical_trials_db]["stocks_filter"].drop() # Only drops if true to ensure there aren't dupes, otherwise it'll continue
     clinical_trials = client[clinical_trials_db][clinical_trials_collection]
     stocks_filter_collection = client[clinical_trials_db][new_coll]
 
+    # Let the $match below use an index instead of scanning every study
+    clinical_trials.create_index(SPONSOR_FIELD)
+
     clinical_trials_modules = {
         "protocolSection.identificationModule": 1,
         "protocolSection.sponsorCollaboratorsModule": 1,
@@ -32,18 +37,27 @@ def clean_clinical_trials_data(stock_data):
         "protocolSection.oversightModule": 1,
         "protocolSection.statusModule": 1,
         "protocolSection.armsInterventionsModule": 1,
-        "protocolSection.interventionBrowseModule": 1
+        "protocolSection.interventionBrowseModule": 1,
+        "derivedSection.interventionBrowseModule": 1
     }
 
-    query = {"protocolSection.sponsorCollaboratorsModule.leadSponsor.name": {"$in" : company_list}}
-    results = list(clinical_trials.find(query, clinical_trials_modules))
-    print("Inserting each doc into `clinical_trials_db` called `", new_coll, "`")
-    for doc in results:
-        stocks_filter_collection.insert_one(doc)
+    # Filter and project inside MongoDB; $out swaps in the new collection so there aren't dupes
+    pipeline = [
+        {"$match": {SPONSOR_FIELD: {"$in": company_list}}},
+        {"$project": clinical_trials_modules},
+        {"$out": new_coll}
+    ]
+    print("Materializing matching studies into `clinical_trials_db` called `", new_coll, "`")
+    clinical_trials.aggregate(pipeline, allowDiskUse=True)
+
+    # combine_fda_and_ct reads this collection by sponsor and trial id
+    stocks_filter_collection.create_index(SPONSOR_FIELD)
+    stocks_filter_collection.create_index("protocolSection.identificationModule.nctId")
+    print(stocks_filter_collection.estimated_document_count(), "studies in `", new_coll, "`")
 
     # Close the connection to the "studies" collection
     client.close()
 
 if __name__ == "__main__":
-    stock_data = load_stock_data("./data_ingest/raw_data/merged_stock_data.csv")
+    stock_data = load_stock_data()
     clinical_trials_data = clean_clinical_trials_data(stock_data)
@@ -1,16 +1,25 @@
-import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
-df = pd.read_csv('./data_cleaning/processed_data/combine_fda_and_ct.csv')
+def main():
+    # Typed matches from combine_fda_and_ct: dates and list columns need no parsing
+    table = pq.read_table('./data_cleaning/processed_data/combine_fda_and_ct.parquet')
 
-# Convert 'ct_date' and 'fda_date' to datetime
-df['ct_date'] = pd.to_datetime(df['ct_date'], format='%Y-%m-%d', errors='coerce').combine_first(pd.to_datetime(df['ct_date'], format='%Y-%m', errors='coerce'))
-df['fda_date'] = pd.to_datetime(df['fda_date'], format='%Y%m%d', errors='coerce')
+    # Filter for drugs that have been approved by FDA after the start of the clinical trial and remove any mention of phase 1
+    approved_after = pc.or_kleene(pc.greater_equal(table['fda_date'], table['ct_date']), pc.is_null(table['fda_date']))
+    phases = table['ct_phase'].combine_chunks()
+    is_phase1 = pc.match_substring(pc.list_flatten(phases), 'PHASE1').to_numpy(zero_copy_only=False)
+    phase1_rows = pc.list_parent_indices(phases).to_numpy()[is_phase1]
+    not_phase1 = pa.array(~np.isin(np.arange(len(table)), phase1_rows))
+    table = table.filter(pc.and_kleene(approved_after, not_phase1))
 
-# Filter for drugs that have been approved by FDA after the start of the clinical trial and remove any mention of phase 1
-df = df[(df['fda_date'] >= df['ct_date']) | (df['fda_date'].isna())]
-df = df[~df['ct_phase'].str.contains('PHASE1', na=False)]
+    # Sort by company name then by fda_date both ascending
+    table = table.sort_by([('fda_company', 'ascending'), ('fda_date', 'ascending')])
 
-# Sort by company name then by fda_date both ascending
-df = df.sort_values(by=['fda_company', 'fda_date'], ascending=[True, True])
+    pq.write_table(table, './data_cleaning/processed_data/filtered_drugs.parquet')
 
-df.to_csv('./data_cleaning/processed_data/filtered_drugs.csv', index=False)
+
+if __name__ == "__main__":
+    main()
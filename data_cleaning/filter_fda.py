@@ -1,83 +1,196 @@
 import pandas as pd
+import numpy as np
 from pprint import pprint
-from rapidfuzz import fuzz
+from rapidfuzz import fuzz, process
 from pymongo import MongoClient
+import argparse
 import re
 
+from utils import price_store
+from utils.instrumentation import stage, instrument
+
 # MongoDB connection details
 mongo_uri = "mongodb://localhost:27017/"
 clinical_trials_db = "clinical_trials_db"
 openfda_db = "openfda"
 openfda_collection = "drugs"
 new_coll = "stocks_filter"
+clinical_trials_collection = "studies"
+NGRAM_SIZE = 3  # Character n-grams used to block candidate pairs before scoring
+
+PUNCTUATION_RE = re.compile(r'[\.,]')
+COMPANY_WORDS_RE = re.compile(r'\b(pharmaceutical|biomedical|pharm|lifesciences|technology|diagnostics|ltd|holdings|corp|corporation|therapies|health|medicines|labs|laboratories|limited|technologies|inc|llc|therapeutics|pharmaceuticals|biotherapeutics|biosciences|pharma|plc|biotechnology|therapeutix|sciences|life sciences|medical)\b')
+WHITESPACE_RE = re.compile(r'\s+')
 
-def load_stock_data(file_path):
-    return pd.read_csv(file_path)
+def load_stock_data():
+    # Only the company names are needed here, so only that column is read from the price store
+    return price_store.read_prices(columns=["company_ct"])
 
 def preprocess_text(text):
     # Remove punctuation, make lowercase, and remove specific words
-    text = re.sub(r'[\.,]', '', text).lower()
-    text = re.sub(r'\b(pharmaceutical|biomedical|pharm|lifesciences|technology|diagnostics|ltd|holdings|corp|corporation|therapies|health|medicines|labs|laboratories|limited|technologies|inc|llc|therapeutics|pharmaceuticals|biotherapeutics|biosciences|pharma|plc|biotechnology|therapeutix|sciences|life sciences|medical)\b', '', text)
-    return re.sub(r'\s+', ' ', text).strip()
+    text = PUNCTUATION_RE.sub('', text).lower()
+    text = COMPANY_WORDS_RE.sub('', text)
+    return WHITESPACE_RE.sub(' ', text).strip()
+
+def ngrams(text, n=NGRAM_SIZE):
+    # Pad so short names and word boundaries still produce grams
+    padded = f" {text} "
+    if len(padded) <= n:
+        return {padded}
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+def build_ngram_index(names):
+    """
+    Map each character n-gram to the positions of the names containing it
+    """
+    index = {}
+    for position, name in enumerate(names):
+        for gram in ngrams(name):
+            index.setdefault(gram, []).append(position)
+    return {gram: np.array(positions) for gram, positions in index.items()}
 
-def filter_fda(threshold):
+def match_sponsors(sponsor_names, company_ct_list, threshold, workers=-1):
+    """
+    Best company_ct for each FDA sponsor with fuzz.ratio >= threshold, as {sponsor: company_ct}.
+    Both sides are preprocessed once. Candidate pairs must share an n-gram and have lengths
+    that can reach the threshold, and all surviving pairs are scored in one multi-core cpdist call.
+    Ties go to the earliest company in company_ct_list, like the original nested loop.
+    N-gram blocking can miss very short names at low thresholds; at 80+ it matches the full scan.
+    """
+    # Preprocess each company once, keeping the first company for duplicate processed names
+    processed_companies = {}
+    for company_ct in company_ct_list:
+        if company_ct:
+            processed_companies.setdefault(preprocess_text(company_ct), company_ct)
+    company_keys = list(processed_companies)
+    company_lengths = np.array([len(name) for name in company_keys])
+    index = build_ngram_index(company_keys)
+
+    sponsors = list(sponsor_names)
+    processed_sponsors = [preprocess_text(sponsor) for sponsor in sponsors]
+
+    # Ratio is 100 * (1 - indel distance / total length), and the distance is at least the length difference
+    sponsor_idx, company_idx = [], []
+    for i, name in enumerate(processed_sponsors):
+        postings = [index[gram] for gram in ngrams(name) if gram in index]
+        if not postings:
+            continue
+        candidates = np.unique(np.concatenate(postings))
+        lengths = company_lengths[candidates]
+        candidates = candidates[np.abs(lengths - len(name)) * 100 <= (100 - threshold) * (lengths + len(name))]
+        sponsor_idx.append(np.full(len(candidates), i))
+        company_idx.append(candidates)
+
+    if not sponsor_idx:
+        return {}
+    sponsor_idx = np.concatenate(sponsor_idx)
+    company_idx = np.concatenate(company_idx)
+
+    scores = process.cpdist(
+        [processed_sponsors[i] for i in sponsor_idx],
+        [company_keys[j] for j in company_idx],
+        scorer=fuzz.ratio, score_cutoff=threshold, dtype=np.float64, workers=workers
+    )
+    keep = scores >= threshold
+    sponsor_idx, company_idx, scores = sponsor_idx[keep], company_idx[keep], scores[keep]
+
+    # Highest score per sponsor, earliest company on ties
+    order = np.lexsort((company_idx, -scores, sponsor_idx))
+    sponsor_idx, company_idx = sponsor_idx[order], company_idx[order]
+    first = np.ones(len(sponsor_idx), dtype=bool)
+    first[1:] = sponsor_idx[1:] != sponsor_idx[:-1]
+
+    return {
+        sponsors[i]: processed_companies[company_keys[j]]
+        for i, j in zip(sponsor_idx[first], company_idx[first])
+    }
+
+def load_ct_sponsors(client):
+    # Every lead sponsor in the clinical trials, not just the ones with a stock ticker
+    return client[clinical_trials_db][clinical_trials_collection].distinct(
+        "protocolSection.sponsorCollaboratorsModule.leadSponsor.name"
+    )
+
+@instrument()
+def filter_fda(threshold, all_sponsors=False):
     """
     Fetch unique sponsor names from fda_coll, match them with stock_data["company_ct"] using rapidfuzz,
     and store the lookup table into a CSV file with a similarity threshold.
+    With all_sponsors, match against every clinical trial lead sponsor instead.
     """
     client = MongoClient(mongo_uri)
     fda_coll = client[openfda_db][openfda_collection]
     
-    # Drop coll if exists, then create coll for filtered FDA data based on stocks
-    client[openfda_db][new_coll].drop()
+    # Filtered FDA data based on stocks, replaced wholesale by the $out stage below
     filtered_fda = client[openfda_db][new_coll]
 
     # Fetch unique sponsor names from FDA collection
     sponsor_names = fda_coll.distinct("sponsor_name")
 
-    # Preprocess sponsor names
-    processed_sponsors = {sponsor: preprocess_text(sponsor) for sponsor in sponsor_names}
-
     # Load stock data
-    stock_data = load_stock_data("./data_ingest/raw_data/merged_stock_data.csv")
-    company_ct_list = stock_data["company_ct"].dropna().unique()
+    if all_sponsors:
+        company_ct_list = load_ct_sponsors(client)
+    else:
+        stock_data = load_stock_data()
+        company_ct_list = stock_data["company_ct"].dropna().unique()
 
     # Match sponsor names with company_ct using rapidfuzz
-    matches = []
-    for sponsor, processed_sponsor in processed_sponsors.items():
-        best_match, best_score = None, 0
-        for company_ct in company_ct_list:
-            processed_company = preprocess_text(company_ct)
-            score = fuzz.ratio(processed_sponsor, processed_company)
-            if score > best_score and score >= threshold:
-                best_match, best_score = company_ct, score
-        if best_match:
-            matches.append({"company_fda": sponsor, "company_ct": best_match})
+    with stage("match_sponsors") as metrics:
+        sponsor_matches = match_sponsors(sponsor_names, company_ct_list, threshold)
+        matches = [
+            {"company_fda": sponsor, "company_ct": sponsor_matches[sponsor]}
+            for sponsor in sponsor_names if sponsor in sponsor_matches
+        ]
+        metrics.rows_in = len(sponsor_names)
+        metrics.rows_out = len(matches)
+    print(f"Matched {len(matches)} of {len(sponsor_names)} FDA sponsors to {len(company_ct_list)} companies")
 
     # Create a DataFrame for the lookup table
-    lookup_df = pd.DataFrame(matches)
+    lookup_df = pd.DataFrame(matches, columns=["company_fda", "company_ct"])
     lookup_df.to_csv("./data_cleaning/processed_data/ct_fda_lkup.csv", index=False, columns=["company_fda", "company_ct"])
 
     # FDA
-    fda_company_list = list(lookup_df.company_fda.unique())
+    fda_company_list = list(lookup_df.company_fda)
+    company_ct_list = list(lookup_df.company_ct)
     fda_modules = {
         "application_number": 1,
         "sponsor_name": 1,
         "products": 1,
         "openfda.generic_name": 1,
-        "submissions": {"$elemMatch": {"submission_type": "ORIG"}}
+        "openfda.substance_name": 1,
+        # Same as the find() projection {"$elemMatch": {"submission_type": "ORIG"}}: first ORIG submission only
+        "submissions": {"$slice": [
+            {"$filter": {"input": {"$ifNull": ["$submissions", []]}, "cond": {"$eq": ["$$this.submission_type", "ORIG"]}}}, 1
+        ]},
+        # Map company_fda to company_ct server side by position in the lookup table
+        "company_ct": {"$arrayElemAt": [company_ct_list, {"$indexOfArray": [fda_company_list, "$sponsor_name"]}]}
     }
 
-    query = {"sponsor_name": {"$in" : fda_company_list}}
-    results = list(fda_coll.find(query, fda_modules))
-    # Map company_fda to company_ct for quick lookup
-    company_ct_map = dict(zip(lookup_df.company_fda, lookup_df.company_ct))
+    # Let the $match below use an index instead of scanning every application
+    fda_coll.create_index("sponsor_name")
+    fda_coll.create_index("application_number")
+
+    # Filter, project and tag inside MongoDB; $out swaps in the new collection
+    pipeline = [
+        {"$match": {"sponsor_name": {"$in": fda_company_list}}},
+        {"$project": fda_modules},
+        {"$out": new_coll}
+    ]
+    with stage("filter_fda_aggregate") as metrics:
+        fda_coll.aggregate(pipeline, allowDiskUse=True)
 
-    for doc in results:
-        sponsor_name = doc.get("sponsor_name")
-        doc["company_ct"] = company_ct_map[sponsor_name]  # Add company_ct to the document
-        filtered_fda.insert_one(doc)
+        # combine_fda_and_ct reads this collection by company and application
+        filtered_fda.create_index("company_ct")
+        filtered_fda.create_index("application_number")
+        metrics.rows_out = filtered_fda.estimated_document_count()
+    print(metrics.rows_out, "FDA applications in `", new_coll, "`")
 
 
 if __name__ == "__main__":
-    filter_fda(95)
+    parser = argparse.ArgumentParser(description='Match FDA sponsors to clinical trial sponsors and filter the FDA data')
+    parser.add_argument('--threshold', type=int, default=95,
+                        help='Minimum rapidfuzz ratio for a sponsor match')
+    parser.add_argument('--all-sponsors', action='store_true',
+                        help='Match against every clinical trial lead sponsor, not only the ones with stock prices')
+    args = parser.parse_args()
+    filter_fda(args.threshold, all_sponsors=args.all_sponsors)
@@ -1,92 +1,41 @@
-import pandas as pd
 import pymongo
 import yfinance as yf
 import requests
 from typing import Optional, List, Dict
 import os
+import argparse
 from dotenv import load_dotenv
 
+from utils import sponsor_stats
+
 MONGO_URI = "mongodb://localhost:27017/"  # Default MongoDB location on local
 db_name = "clinical_trials_db"
 collection_name = "studies"
 
 def main():
+    """
+    Export the sponsor stats collection, which the clinical trials loader keeps current.
+    It is only built here (one $facet pass) when missing or stale, or when --rebuild is passed.
+    """
+    parser = argparse.ArgumentParser(description='Export trials per industry sponsor and collaborator')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Recompute the stats from every study instead of reading the maintained collection')
+    args = parser.parse_args()
+
     print("Setting up MongoDB")
     client = pymongo.MongoClient(MONGO_URI)
     db = client[db_name]
     collection = db[collection_name]
 
-    sponsor_pipeline = [
-      {
-        "$match": {
-          "protocolSection.sponsorCollaboratorsModule.leadSponsor.class": "INDUSTRY"
-        }
-      },
-      {
-        "$group": {
-          "_id": "$protocolSection.sponsorCollaboratorsModule.leadSponsor.name",
-          "sponsor_num_trials": { "$sum": 1 }
-        }
-      },
-      {
-        "$sort": {
-          "sponsor_num_trials": -1
-        }
-      },
-      {
-        "$project": {
-          "company_ct": "$_id",
-          "sponsor_num_trials": 1,
-          "_id": 0
-        }
-      }
-    ]
-
-    collab_pipeline = [
-      {
-        "$unwind": "$protocolSection.sponsorCollaboratorsModule.collaborators"
-      },
-      {
-        "$match": {
-          "protocolSection.sponsorCollaboratorsModule.collaborators.class": "INDUSTRY"
-        }
-      },
-      {
-        "$group": {
-          "_id": "$protocolSection.sponsorCollaboratorsModule.collaborators.name",
-          "collab_num_trials": { "$sum": 1 }
-        }
-      },
-      {
-        "$sort": {
-          "collab_num_trials": -1
-        }
-      },
-      {
-        "$project": {
-          "company_ct": "$_id",
-          "collab_num_trials": 1,
-          "_id": 0
-        }
-      }
-    ]
-
-    print("Running pipelines")
-    # collab_result = list(collection.aggregate(collab_pipeline))
-    sponsor_result = list(collection.aggregate(sponsor_pipeline))
-
-    df_final = pd.DataFrame(sponsor_result)
-    # df_collab = pd.DataFrame(collab_result)
+    if args.rebuild:
+        print("Building sponsor stats")
+        sponsor_stats.rebuild(collection)
+
+    df_final = sponsor_stats.load_stats(db)
 
     # Write DataFrames to CSV
     output_dir = "./data_cleaning/processed_data/"
     df_final.to_csv(f"{output_dir}sponsor_data.csv", index=False)
-    # df_collab.to_csv(f"{output_dir}collaborator_data.csv", index=False)
-
-    # Join on public_company_potential
-    # df_final = df_final.join(df_collab, on="company_ct", how="outer").fillna(0)
-    # df_final["total_num_trials"] = df_final["sponsor_num_trials"] + df_final["collab_num_trials"]
-    # df_final.to_csv(f"{output_dir}merged_data.csv", index=False)
 
     return df_final
 
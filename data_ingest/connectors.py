@@ -1,26 +1,376 @@
 import os
+import re
 import json
+import time
+import yaml
+import difflib
+import queue
+import random
+import atexit
+import asyncio
+import threading
+import httpx
 import requests
 import pandas as pd
-import requests_cache
 import yfinance as yf 
-from munch import Munch
+from email.utils import parsedate_to_datetime
 from dotenv import load_dotenv
+from functools import lru_cache
 from yahoofinancials import YahooFinancials
-from ratelimit import limits, sleep_and_retry
+
+from utils.http_cache import get_cache
+from utils.helpers import parse_partial_dates
 
 # Load environment variables from .env file
 load_dotenv()
 openFDA_api_key = os.getenv("OPENFDA_API_KEY")
 
-# cache API calls in a sqllite file to reduce the number of requests to openfda server
-requests_cache.install_cache('openfda_cache')
-
-OPENFDA_API = "https://api.fda.gov/drug/event.json"
+OPENFDA_BASE_URL = "https://api.fda.gov"
+OPENFDA_API = OPENFDA_BASE_URL + "/drug/event.json"
+OPENFDA_EVENT_ENDPOINT = "/drug/event.json"
 OPENFDA_METADATA_YAML = "https://open.fda.gov/fields/drugevent.yaml"
+FIELD_METADATA_PATH = "./data_ingest/raw_data/openfda_drugevent_fields.json"
+FIELD_METADATA_VERSION = 1  # Bump when the cached layout changes so old caches are refetched
+FIELD_METADATA_TTL = 7 * 24 * 3600  # Revalidate the cached YAML with the server after a week
+
+# OpenFDA API rate limits:
+#      With no API key: 40 requests per minute, per IP address. 1000 requests per day, per IP address.
+#      With an API key: 240 requests per minute, per key. 120000 requests per day, per key.
+OPENFDA_CALLS_PER_MINUTE = 40
+OPENFDA_KEYED_CALLS_PER_MINUTE = 240
+OPENFDA_MAX_CONNECTIONS = 8  # Pooled keep-alive connections shared by every concurrent query
+OPENFDA_MAX_RETRIES = 5  # Retries for 429s, 5xx and dropped connections before giving up
+OPENFDA_TIMEOUT = 30  # Seconds
+OPENFDA_PAGE_SIZE = 1000  # Largest limit openFDA accepts for search queries
+OPENFDA_MAX_SKIP = 25000  # openFDA rejects larger skips; deeper pages follow the search_after cursor
+OPENFDA_PREFETCH_PAGES = 2  # Pages fetched ahead of the caller
+
+
+class RateLimiter:
+    """
+    Sliding one-minute window shared by every request of a client.
+    A 429 pauses all requests until its Retry-After and lowers the budget by a quarter;
+    each success afterwards wins one call per minute back, up to the documented limit.
+    """
+
+    def __init__(self, calls_per_minute, period=60):
+        self.max_calls = calls_per_minute
+        self.calls = calls_per_minute
+        self.period = period
+        self.sent = []
+        self.resume_at = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.sent = [t for t in self.sent if t > now - self.period]
+                if now < self.resume_at:
+                    wait = self.resume_at - now
+                elif len(self.sent) < self.calls:
+                    self.sent.append(now)
+                    return
+                else:
+                    wait = self.sent[len(self.sent) - self.calls] + self.period - now
+                await asyncio.sleep(wait)
+
+    def throttle(self, retry_after):
+        self.resume_at = max(self.resume_at, time.monotonic() + retry_after)
+        self.calls = max(1, int(self.calls * 0.75))
+
+    def recover(self):
+        self.calls = min(self.max_calls, self.calls + 1)
+
+
+def retry_after_seconds(response, attempt):
+    """
+    Seconds to wait from a Retry-After header (delay or HTTP date), else exponential backoff with jitter
+    """
+    header = response.headers.get("Retry-After") if response is not None else None
+    if header:
+        try:
+            return max(0.0, float(header))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(header).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    return min(60.0, 2 ** attempt) + random.random()
+
+
+class OpenFDAClient:
+    """
+    Asynchronous openFDA client with pooled connections and one rate budget for all its requests.
+    Use as `async with OpenFDAClient() as client:` and fan out with client.gather(...).
+    The budget is 240/min when OPENFDA_API_KEY is set, 40/min otherwise.
+    """
+
+    def __init__(self, api_key=openFDA_api_key, calls_per_minute=None, max_connections=OPENFDA_MAX_CONNECTIONS,
+                 validate_fields=True, cache=True):
+        self.api_key = api_key
+        self.validate_fields = validate_fields
+        self.registry = None
+        self.registry_lock = asyncio.Lock()
+        # Responses are cached per endpoint TTL (utils/http_cache.py) to cut requests to the openfda server
+        self.cache = get_cache() if cache else None
+        if calls_per_minute is None:
+            calls_per_minute = OPENFDA_KEYED_CALLS_PER_MINUTE if api_key else OPENFDA_CALLS_PER_MINUTE
+        self.limiter = RateLimiter(calls_per_minute)
+        self.http = httpx.AsyncClient(
+            base_url=OPENFDA_BASE_URL,
+            timeout=OPENFDA_TIMEOUT,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.http.aclose()
+
+    async def field_registry(self):
+        """
+        The drug event field registry, loaded once in a worker thread so the metadata download
+        doesn't block the other requests on the event loop
+        """
+        async with self.registry_lock:
+            if self.registry is None:
+                self.registry = await asyncio.to_thread(field_registry)
+        return self.registry
+
+    async def request(self, endpoint, params=None):
+        """
+        GET an endpoint such as /drug/event.json and return the httpx response.
+        404 is openFDA's "no matches" and is returned as is; 429, 5xx and connection errors are retried.
+        Drug event search/count fields are checked against the field metadata before anything is sent,
+        and answers still within their cache TTL are served without a request.
+        """
+        params = dict(params or {})
+        if self.validate_fields and endpoint == OPENFDA_EVENT_ENDPOINT:
+            try:
+                registry = await self.field_registry()
+            except Exception as e:
+                print(f"Skipping field validation, drug event metadata unavailable: {e}")
+                self.validate_fields = False
+            else:
+                registry.validate_params(params)
+
+        url = OPENFDA_BASE_URL + endpoint
+        cached = self.cache.lookup(url, params) if self.cache else None
+        if cached:
+            status, headers, body = cached
+            return httpx.Response(status, headers=headers, content=body, request=httpx.Request("GET", url, params=params))
+
+        if self.api_key:
+            params["api_key"] = self.api_key
+
+        for attempt in range(OPENFDA_MAX_RETRIES + 1):
+            await self.limiter.acquire()
+            try:
+                response = await self.http.get(endpoint, params=params)
+            except httpx.TransportError:
+                if attempt == OPENFDA_MAX_RETRIES:
+                    raise
+                await asyncio.sleep(retry_after_seconds(None, attempt))
+                continue
+
+            if response.status_code == 429:
+                self.limiter.throttle(retry_after_seconds(response, attempt))
+                continue
+            if response.status_code >= 500 and attempt < OPENFDA_MAX_RETRIES:
+                await asyncio.sleep(retry_after_seconds(response, attempt))
+                continue
+            if response.status_code not in (200, 404):
+                raise Exception('API response: {}'.format(response.status_code))
+            self.limiter.recover()
+            if self.cache:
+                self.cache.store(url, params, response.status_code, dict(response.headers), response.content)
+            return response
+        raise Exception('API response: 429 after {} retries'.format(OPENFDA_MAX_RETRIES))
+
+    async def get(self, params=None, endpoint="/drug/event.json"):
+        """
+        The results of one query; [] when nothing matches
+        """
+        params = dict(params or {})
+        params['limit'] = params.get('limit', 1000)
+        response = await self.request(endpoint, params)
+        if response.status_code == 404:
+            return []
+        return response.json()['results']
+
+    async def search(self, search, endpoint="/drug/event.json", limit=1000, **params):
+        return await self.get(dict(params, search=search, limit=limit), endpoint)
+
+    async def count(self, field, search=None, endpoint="/drug/event.json", limit=1000):
+        params = {"count": field, "limit": limit}
+        if search:
+            params["search"] = search
+        return await self.get(params, endpoint)
+
+    async def gather(self, queries, endpoint="/drug/event.json"):
+        """
+        Run many parameter dicts concurrently; results come back in the same order.
+        Concurrency is bounded by the connection pool and the rate budget.
+        """
+        return await asyncio.gather(*(self.get(params, endpoint) for params in queries))
+
+    async def iter_pages(self, params=None, endpoint="/drug/event.json", page_size=OPENFDA_PAGE_SIZE, max_records=None):
+        """
+        Yield every page of results for a search, fetching the next page while the caller handles this one.
+        Pages follow the search_after cursor from the Link header when openFDA sends one,
+        and skip/limit otherwise (up to openFDA's skip ceiling).
+        """
+        params = dict(params or {})
+        params.pop("skip", None)
+        params["limit"] = page_size = min(page_size, max_records) if max_records else page_size
+        yielded = 0
+
+        async def fetch(page_params):
+            response = await self.request(endpoint, page_params)
+            if response.status_code == 404:
+                return [], None, 0
+            body = response.json()
+            total = body.get("meta", {}).get("results", {}).get("total", 0)
+            next_url = response.links.get("next", {}).get("url")
+            search_after = httpx.URL(next_url).params.get("search_after") if next_url else None
+            return body.get("results", []), search_after, total
+
+        next_page = asyncio.ensure_future(fetch(params))
+        skip = 0
+        try:
+            while next_page:
+                results, search_after, total = await next_page
+                next_page = None
+                if max_records is not None:
+                    results = results[:max_records - yielded]
+                skip += len(results)
+                more = len(results) == page_size and skip < total and (max_records is None or yielded + len(results) < max_records)
+
+                if more and search_after:
+                    next_page = asyncio.ensure_future(fetch(dict(params, search_after=search_after)))
+                elif more and skip <= OPENFDA_MAX_SKIP:
+                    next_page = asyncio.ensure_future(fetch(dict(params, skip=skip)))
+                elif more:
+                    print(f"Stopped after {skip} of {total} results: openFDA allows skip up to {OPENFDA_MAX_SKIP} without a search_after cursor")
+
+                if results:
+                    yielded += len(results)
+                    yield results
+        finally:
+            if next_page:
+                next_page.cancel()
+
+    async def iter_records(self, params=None, endpoint="/drug/event.json", page_size=OPENFDA_PAGE_SIZE, max_records=None):
+        async for page in self.iter_pages(params, endpoint, page_size, max_records):
+            for record in page:
+                yield record
+
+
+_shared_loop = None
+_shared_client = None
+_shared_lock = threading.Lock()
+
+
+def shared_client():
+    """
+    The process-wide client behind call_api, fetch_many and paginate: one rate budget and one
+    connection pool for every synchronous call. It lives on its own event loop thread, started on
+    first use, so synchronous callers work whether or not their thread already runs a loop (eg Jupyter).
+    """
+    global _shared_loop, _shared_client
+    with _shared_lock:
+        if _shared_client is None:
+            _shared_loop = asyncio.new_event_loop()
+            threading.Thread(target=_shared_loop.run_forever, name="openfda", daemon=True).start()
+            _shared_client = OpenFDAClient()
+            atexit.register(_close_shared_client)
+    return _shared_client
+
+
+def run_shared(coroutine):
+    """
+    Run a coroutine on the shared client's loop and wait for its result
+    """
+    shared_client()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is _shared_loop:
+        coroutine.close()
+        raise RuntimeError("Synchronous openFDA calls can't run on the shared client's own loop; await the client instead")
+    return asyncio.run_coroutine_threadsafe(coroutine, _shared_loop).result()
+
+
+def _close_shared_client():
+    global _shared_client
+    with _shared_lock:
+        client, _shared_client = _shared_client, None
+    if client is not None:
+        asyncio.run_coroutine_threadsafe(client.aclose(), _shared_loop).result(timeout=OPENFDA_TIMEOUT)
+        _shared_loop.call_soon_threadsafe(_shared_loop.stop)
+
+
+def paginate(params=None, endpoint="/drug/event.json", page_size=OPENFDA_PAGE_SIZE, max_records=None):
+    """
+    Lazily yield every record matching an openFDA query from synchronous code.
+    A background thread drives the shared client and keeps up to OPENFDA_PREFETCH_PAGES pages queued,
+    so memory stays at a few pages however many records the query has.
+    Example: for event in paginate({"search": 'patient.drug.openfda.brand_name:"BIZENGRI"'}): ...
+    """
+    page_queue = queue.Queue(maxsize=OPENFDA_PREFETCH_PAGES)
+    stop_event = threading.Event()
+    done = object()
+
+    def put(item):
+        # Give up when the consumer has stopped reading instead of blocking on a full queue forever
+        while not stop_event.is_set():
+            try:
+                page_queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    async def produce():
+        async for page in shared_client().iter_pages(params, endpoint, page_size, max_records):
+            # Wait off the event loop so the prefetched page keeps downloading
+            if not await asyncio.to_thread(put, page):
+                return
+
+    def run():
+        try:
+            run_shared(produce())
+            put(done)
+        except Exception as e:
+            put(e)
+
+    producer = threading.Thread(target=run, daemon=True)
+    producer.start()
+    try:
+        while True:
+            page = page_queue.get()
+            if page is done:
+                break
+            if isinstance(page, Exception):
+                raise page
+            yield from page
+    finally:
+        stop_event.set()
+        producer.join()
+
+
+def fetch_many(queries, endpoint="/drug/event.json"):
+    """
+    Synchronous entry point: run a list of openFDA parameter dicts concurrently through the shared client
+    """
+    return run_shared(shared_client().gather(queries, endpoint))
 
-@sleep_and_retry
-@limits(calls=40, period=60)
 
 def call_api(params):
     """
@@ -28,42 +378,146 @@ def call_api(params):
     Input: dictionary with API parameters {search: '...', count: '...'}
     Output: nested dictionary representation of the JSON results section
     
-    OpenFDA API rate limits:
-         With no API key: 40 requests per minute, per IP address. 1000 requests per day, per IP address.
-         With an API key: 240 requests per minute, per key. 120000 requests per day, per key.
+    Uses the API key from .env when set (240 requests per minute instead of 40).
+    Every call goes through the shared client, so sequential calls share its rate budget and connections.
+    To query many drugs at once use fetch_many, which runs them concurrently.
+    Only the first page (up to 1000 results) is returned; use paginate for every match.
+    """
+    return fetch_many([params or {}])[0]
+
+SEARCH_FIELD_RE = re.compile(r'([A-Za-z_][\w.]*)\s*:')
+EXISTS_FIELD_RE = re.compile(r'_(?:exists|missing)_\s*:\s*([\w.]+)')
+QUOTED_RE = re.compile(r'"[^"]*"')
+
+
+class FieldRegistry:
+    """
+    Drug event fields from openFDA's drugevent.yaml, flattened to dotted paths
+    Example: registry.fields["patient.patientagegroup"]["possible_values"] -> {"1": "Neonate", ...}
     """
-    if not params:
-        params = {}
-    params['limit'] = params.get('limit', 1000)
 
-    # Uncomment the next line to add API key from .env
-    # params['api_key'] = openFDA_api_key
+    def __init__(self, properties):
+        self.properties = properties
+        self.fields = {}
+        self._flatten(properties, "")
 
-    response = requests.get(OPENFDA_API, params=params)
-    # print(response.url)
+    def _flatten(self, properties, prefix):
+        for name, node in (properties or {}).items():
+            path = prefix + name
+            # Arrays of objects keep their element fields under the array's path, eg patient.drug.medicinalproduct
+            items = node.get("items") or {}
+            children = node.get("properties") or items.get("properties")
+            possible_values = node.get("possible_values") or items.get("possible_values") or {}
+            self.fields[path] = {
+                "type": node.get("type"),
+                "item_type": items.get("type"),
+                "format": node.get("format") or items.get("format"),
+                "is_exact": bool(node.get("is_exact") or items.get("is_exact")),
+                "description": node.get("description"),
+                "possible_values": possible_values.get("value") if possible_values.get("type") == "one_of" else None
+            }
+            if children:
+                self._flatten(children, path + ".")
 
-    if response.status_code != 200:
-        raise Exception('API response: {}'.format(response.status_code))
-    return response.json()['results']
+    def __contains__(self, path):
+        return path in self.fields
 
-def api_meta():
+    def type_of(self, path):
+        field = self.fields[path]
+        return field["item_type"] if field["type"] == "array" and field["item_type"] else field["type"]
+
+    def possible_values(self, path):
+        return self.fields[path]["possible_values"]
+
+    def check(self, path):
+        """
+        Raise ValueError for a field openFDA doesn't have, suggesting the closest names.
+        A .exact suffix is only allowed on fields openFDA indexes for exact matching.
+        """
+        base = path[:-len(".exact")] if path.endswith(".exact") else path
+        if base not in self.fields:
+            suggestions = difflib.get_close_matches(base, self.fields, n=3)
+            hint = f" (did you mean {', '.join(suggestions)}?)" if suggestions else ""
+            raise ValueError(f"Unknown drug event field '{base}'{hint}")
+        if base != path and not self.fields[base]["is_exact"]:
+            raise ValueError(f"Field '{base}' does not support .exact")
+
+    def search_fields(self, search):
+        """
+        Field names referenced by an openFDA search expression, eg
+        'patient.drug.openfda.brand_name:"KEYTRUDA" AND _exists_:serious' -> [..brand_name, serious]
+        """
+        unquoted = QUOTED_RE.sub('""', search)
+        fields = EXISTS_FIELD_RE.findall(unquoted)
+        fields += [f for f in SEARCH_FIELD_RE.findall(unquoted) if f not in ("_exists_", "_missing_")]
+        return fields
+
+    def validate_params(self, params):
+        for path in self.search_fields(params.get("search") or ""):
+            self.check(path)
+        if params.get("count"):
+            self.check(params["count"])
+
+
+def load_field_metadata(force=False):
     """
-    YAML file with field description and other metadata retrieved from the OpenFDA website
-    Parses YAML file and provides syntactic sugar for accessing nested dictionaries
-    Example: .patient.properties.patientagegroup.possible_values.value
-    Note: reserved words, such as count and items still have to be accessed via ['count'], ['items']
+    The properties section of drugevent.yaml, cached on disk. The cache is used as is for a week,
+    then revalidated with its ETag/Last-Modified; a cache from an older FIELD_METADATA_VERSION is refetched.
     """
+    cached = None
+    if os.path.exists(FIELD_METADATA_PATH):
+        with open(FIELD_METADATA_PATH, "r") as f:
+            cached = json.load(f)
+        if cached.get("version") != FIELD_METADATA_VERSION:
+            cached = None
+
+    if cached and not force and time.time() - cached["fetched_at"] < FIELD_METADATA_TTL:
+        return cached["properties"]
 
-    response = requests.get(OPENFDA_METADATA_YAML)
-    if response.status_code != 200:
+    headers = {}
+    if cached and not force:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+    response = requests.get(OPENFDA_METADATA_YAML, headers=headers, timeout=OPENFDA_TIMEOUT)
+    if cached and response.status_code == 304:
+        cached["fetched_at"] = time.time()
+    elif response.status_code == 200:
+        cached = {
+            "version": FIELD_METADATA_VERSION,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "fetched_at": time.time(),
+            "properties": yaml.safe_load(response.text)["properties"]
+        }
+    else:
         raise Exception('Could not retrieve YAML file with drug event API fields')
-    
-    # munch is a yaml parser with javascript-style object access
-    y = Munch.fromYAML(response.text)
-    return y['properties']
 
-# Print api_meta in pretty JSON format
-print(json.dumps(api_meta(), indent=4))
+    os.makedirs(os.path.dirname(FIELD_METADATA_PATH), exist_ok=True)
+    tmp_path = FIELD_METADATA_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(cached, f)
+    os.replace(tmp_path, FIELD_METADATA_PATH)
+    return cached["properties"]
+
+
+@lru_cache(maxsize=None)
+def field_registry():
+    """
+    Loaded on first use, not at import, and shared for the life of the process
+    """
+    return FieldRegistry(load_field_metadata())
+
+
+def api_meta():
+    """
+    Field description and other metadata from the OpenFDA drugevent.yaml, as nested dictionaries
+    Example: api_meta()['patient']['properties']['patientagegroup']['possible_values']['value']
+    For lookups by dotted path use field_registry(), eg field_registry().possible_values('patient.patientagegroup')
+    """
+    return field_registry().properties
 
 
 pd.set_option('display.max_rows', None)
@@ -143,11 +597,9 @@ def clinical_trials():
     df = pd.DataFrame(data_list)
     df = df[(df['primary_completion_date'] != 'Unknown Date') & (df['sponsor_class'] == 'INDUSTRY')].reset_index()
     del df['index']
-    df['clean_primary_completion_date'] = (
-        df['primary_completion_date'].str.strip().apply(lambda x: pd.to_datetime(x, format='%Y-%m-%d', errors='coerce') 
-                                                        if len(x) > 7 else pd.to_datetime(x + '-01', format='%Y-%m-%d')
-                                                        )
-                                        )
+    completion_dates = parse_partial_dates(df['primary_completion_date'])
+    df['clean_primary_completion_date'] = completion_dates['date']
+    df['primary_completion_date_precision'] = completion_dates['precision']
     df = df[df['clean_primary_completion_date'] >= pd.Timestamp.now() - pd.DateOffset(years=10)].reset_index()
     df['is_phase4'] = df['phases'].apply(lambda x: 1 if str(x).strip() == "['PHASE4']" else 0)
     del df['index']
@@ -174,5 +626,7 @@ def stocks(start_date='2014-11-20', end_date='2024-11-20'):
 
 
 if __name__ == "__main__":
+    # Print api_meta in pretty JSON format
+    print(json.dumps(api_meta(), indent=4))
     clinical_trials()
     # stocks()
\ No newline at end of file
@@ -1,6 +1,15 @@
+import sys
 import time
+import queue
+import argparse
+import threading
 import pymongo
 import requests
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+
+from utils.instrumentation import stage
+from utils import sponsor_stats
 
 
 # Main variables
@@ -9,6 +18,11 @@ PAGE_SIZE = 1000  # Number of records allowed per page
 MONGO_URI = "mongodb://localhost:27017/"  # Default MongoDB location on local
 db_name = "clinical_trials_db"
 collection_name = "studies"
+state_collection_name = "ingest_state"  # Keeps the last written nextPageToken so a crashed load can resume
+PREFETCH_PAGES = 4  # Pages allowed to sit between the fetcher and the writer
+DUPLICATE_KEY_ERROR = 11000
+NCT_ID_FIELD = "protocolSection.identificationModule.nctId"
+LAST_UPDATE_FIELD = "protocolSection.statusModule.lastUpdatePostDateStruct.date"
 
 
 def fetch_page(params):
@@ -16,26 +30,281 @@ def fetch_page(params):
     Fetch a single page of results from the ClinicalTrials.gov API
     """
 
-    response = requests.get(BASE_URL, params=params)
-    print("Fetching data from:", BASE_URL + '?' + '&'.join([f"{k}={v}" for k, v in params.items()]))
-    if response.status_code != 200:
-        raise requests.exceptions.RequestException(f"Failed to fetch data: {response.status_code}")
-    return response.json()
+    with stage("fetch_page") as metrics:
+        response = requests.get(BASE_URL, params=params)
+        metrics.http(response)
+        print("Fetching data from:", BASE_URL + '?' + '&'.join([f"{k}={v}" for k, v in params.items()]))
+        if response.status_code != 200:
+            raise requests.exceptions.RequestException(f"Failed to fetch data: {response.status_code}")
+        data = response.json()
+        metrics.rows_out = len(data.get("studies", []))
+        return data
 
 
-def main():
+def write_page(collection, studies):
     """
-    With your MongoDB instance up, query the API and load in each study
+    Write one page of studies in a single unordered bulk insert.
+    Studies already loaded (eg when a page is replayed after a resume) are skipped by the nctId index.
     """
-    print(f"Setting up MongoDB instance")
-    client = pymongo.MongoClient(MONGO_URI)
-    db = client[db_name]
+
+    with stage("insert_many") as metrics:
+        metrics.rows_in = len(studies)
+        try:
+            collection.insert_many(studies, ordered=False)
+            metrics.rows_out = len(studies)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error["code"] != DUPLICATE_KEY_ERROR for error in errors):
+                raise
+            metrics.rows_out = e.details.get("nInserted", 0)
+            metrics.count("duplicates_skipped", len(errors))
+
+
+def load_checkpoint(state):
+    """
+    Return the pageToken of the last fully written page, or None if there is nothing to resume
+    """
+
+    checkpoint = state.find_one({"_id": collection_name})
+    if checkpoint and not checkpoint.get("complete"):
+        return checkpoint.get("page_token")
+    return None
+
+
+def save_checkpoint(state, page_token, pages_written, complete=False):
+    state.update_one(
+        {"_id": collection_name},
+        {"$set": {"page_token": page_token, "pages_written": pages_written, "complete": complete}},
+        upsert=True
+    )
+
+
+def reset_state(state):
+    """
+    Forget the finished flag and high-water mark once the collection is dropped,
+    so a sync can't run from them onto a partial collection
+    """
+
+    state.update_one(
+        {"_id": collection_name},
+        {"$set": {"page_token": None, "pages_written": 0, "complete": False},
+         "$unset": {"last_update_post_date": ""}},
+        upsert=True
+    )
+
+
+def fetch_pages(params, page_queue, stop_event):
+    """
+    Producer: walk the nextPageToken chain and hand each page to the writer.
+    Always finishes by putting None (done) or the raised exception on the queue.
+    """
+
+    try:
+        while not stop_event.is_set():
+            data = fetch_page(params)
+            studies = data.get("studies", [])
+            if not studies:
+                print("No more data returned from the API.")
+                break
+
+            next_page_token = data.get("nextPageToken")
+            page_queue.put((studies, next_page_token))
+            if not next_page_token:
+                break
+            params["pageToken"] = next_page_token
+    except Exception as e:
+        page_queue.put(e)
+        return
+    page_queue.put(None)
+
+
+def consume_pages(params, on_page):
+    """
+    Run the fetcher on a background thread and call on_page(studies, next_page_token)
+    for each page as it arrives, so network waits overlap with MongoDB writes.
+    Returns the number of pages handled.
+    """
+
+    page_queue = queue.Queue(maxsize=PREFETCH_PAGES)
+    stop_event = threading.Event()
+    fetcher = threading.Thread(target=fetch_pages, args=(params, page_queue, stop_event), daemon=True)
+    fetcher.start()
+
+    pages = 0
+    try:
+        while True:
+            item = page_queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+
+            studies, next_page_token = item
+            on_page(studies, next_page_token)
+            pages += 1
+    finally:
+        stop_event.set()
+    return pages
+
+
+def create_indexes(collection):
+    collection.create_index(NCT_ID_FIELD, unique=True)
+    collection.create_index(LAST_UPDATE_FIELD)
+
+
+def latest_update_date(collection):
+    """
+    Newest lastUpdatePostDate in the collection (dates are ISO strings so they sort lexically)
+    """
+
+    doc = collection.find_one({}, {LAST_UPDATE_FIELD: 1}, sort=[(LAST_UPDATE_FIELD, pymongo.DESCENDING)])
+    if not doc:
+        return None
+    return doc.get("protocolSection", {}).get("statusModule", {}).get("lastUpdatePostDateStruct", {}).get("date")
+
+
+def save_high_water_mark(db):
+    date = latest_update_date(db[collection_name])
+    db[state_collection_name].update_one(
+        {"_id": collection_name},
+        {"$set": {"last_update_post_date": date}},
+        upsert=True
+    )
+    return date
+
+
+def load_pipelined(db, fresh=False):
+    """
+    Overlap API fetches with MongoDB writes. A background thread fetches pages while
+    this thread bulk inserts them, checkpointing the nextPageToken after every page
+    so a rerun picks up where a crashed load stopped instead of starting over.
+    Returns True once the last page is written.
+    """
+
+    collection = db[collection_name]
+    state = db[state_collection_name]
+
+    page_token = None if fresh else load_checkpoint(state)
+    if page_token:
+        print(f"Resuming load from pageToken {page_token}")
+        pages_written = state.find_one({"_id": collection_name}).get("pages_written", 0)
+    else:
+        db[collection_name].drop()
+        reset_state(state)
+        pages_written = 0
+    sponsor_stats.invalidate(db)
+    create_indexes(collection)
+
+    params = {
+        "pageSize": PAGE_SIZE
+    }
+    if page_token:
+        params["pageToken"] = page_token
+
+    def on_page(studies, next_page_token):
+        nonlocal pages_written
+        write_page(collection, studies)
+        pages_written += 1
+        save_checkpoint(state, next_page_token, pages_written, complete=not next_page_token)
+
+    try:
+        consume_pages(params, on_page)
+    except requests.exceptions.RequestException as e:
+        print(f"An error occurred: {e}")
+        print(f"Rerun to resume after page {pages_written}")
+        return False
+
+    save_checkpoint(state, None, pages_written, complete=True)
+    print(f"Built sponsor stats for {sponsor_stats.rebuild(collection)} companies")
+    print(f"Wrote {pages_written} pages, data current through {save_high_water_mark(db)}")
+    return True
+
+
+def upsert_page(collection, studies):
+    """
+    Replace each study by nctId, inserting the ones we haven't seen before,
+    and move the sponsor stats by the difference from the replaced versions
+    """
+
+    before = sponsor_stats.previous_counts(collection, studies)
+    operations = [
+        ReplaceOne({NCT_ID_FIELD: study["protocolSection"]["identificationModule"]["nctId"]}, study, upsert=True)
+        for study in studies
+    ]
+    try:
+        with stage("bulk_write") as metrics:
+            metrics.rows_in = len(operations)
+            result = collection.bulk_write(operations, ordered=False)
+            metrics.rows_out = result.upserted_count + result.modified_count
+    except Exception:
+        # Part of the page may have been written; recount from the collection instead of guessing.
+        # If the rebuild fails too, the stats stay marked stale and the next reader rebuilds them.
+        sponsor_stats.invalidate(collection.database)
+        sponsor_stats.rebuild(collection)
+        raise
+    sponsor_stats.apply_changes(collection, before, studies)
+    return result.upserted_count, result.modified_count
+
+
+def load_incremental(db):
+    """
+    Only pull studies whose lastUpdatePostDate is on or after the stored high-water mark
+    and upsert them by nctId. The boundary day is re-requested on purpose since the
+    API only filters by date, and upserts make the overlap harmless.
+    Falls back to a full load when there is no high-water mark yet.
+    Returns True once every updated study is upserted.
+    """
+
+    collection = db[collection_name]
+    state = db[state_collection_name]
+
+    checkpoint = state.find_one({"_id": collection_name}) or {}
+    since = checkpoint.get("last_update_post_date")
+    if not since or not checkpoint.get("complete"):
+        print("No completed load to sync from, running a full load first")
+        return load_pipelined(db)
+
+    create_indexes(collection)
+    print(f"Syncing studies updated since {since}")
+    params = {
+        "pageSize": PAGE_SIZE,
+        "filter.advanced": f"AREA[LastUpdatePostDate]RANGE[{since},MAX]"
+    }
+
+    counts = {"inserted": 0, "updated": 0}
+
+    def on_page(studies, next_page_token):
+        inserted, updated = upsert_page(collection, studies)
+        counts["inserted"] += inserted
+        counts["updated"] += updated
+
+    try:
+        consume_pages(params, on_page)
+    except requests.exceptions.RequestException as e:
+        print(f"An error occurred: {e}")
+        print(f"High-water mark left at {since}, rerun to retry")
+        return False
+
+    print(f"Inserted {counts['inserted']} and updated {counts['updated']} studies, "
+          f"data current through {save_high_water_mark(db)}")
+    return True
+
+
+def load_serial(db):
+    """
+    Original one page, one document at a time load. Returns True when every page was fetched.
+    """
+
     db[collection_name].drop()
+    reset_state(db[state_collection_name])
+    sponsor_stats.invalidate(db)
     collection = db[collection_name]
 
     params = {
         "pageSize": PAGE_SIZE
     }
+    complete = False
+    pages_written = 0
 
     while True:
         try:
@@ -44,17 +313,22 @@ def main():
 
             if not studies:
                 print("No more data returned from the API.")
+                complete = True
                 break
 
             # Insert fetched results into MongoDB
-            for study in studies:
-                collection.insert_one(study)
+            with stage("insert_one") as metrics:
+                for study in studies:
+                    collection.insert_one(study)
+                metrics.rows_in = metrics.rows_out = len(studies)
+            pages_written += 1
 
             # Check for nextPageToken and update the params or break the loop
             next_page_token = data.get("nextPageToken")
             if next_page_token:
                 params["pageToken"] = next_page_token
             else:
+                complete = True
                 break  # Exit the loop if no nextPageToken is present
 
             # Add a small delay to avoid hitting rate limits, if the API has them.
@@ -64,6 +338,38 @@ def main():
             print(f"An error occurred: {e}")
             break
 
+    sponsor_stats.rebuild(collection)
+    if complete:
+        save_checkpoint(db[state_collection_name], None, pages_written, complete=True)
+        print(f"Wrote {pages_written} pages, data current through {save_high_water_mark(db)}")
+    return complete
+
+
+def main():
+    """
+    With your MongoDB instance up, query the API and load in each study
+    """
+    parser = argparse.ArgumentParser(description='Load ClinicalTrials.gov studies into MongoDB')
+    parser.add_argument('--mode', choices=['pipelined', 'sync', 'serial'], default='pipelined',
+                        help='pipelined overlaps fetching with bulk writes and can resume; '
+                             'sync only upserts studies updated since the last load; serial is the original loop')
+    parser.add_argument('--fresh', action='store_true',
+                        help='Ignore any saved checkpoint and reload from the first page')
+    args = parser.parse_args()
+
+    print(f"Setting up MongoDB instance")
+    client = pymongo.MongoClient(MONGO_URI)
+    db = client[db_name]
+
+    if args.mode == 'pipelined':
+        complete = load_pipelined(db, fresh=args.fresh)
+    elif args.mode == 'sync':
+        complete = load_incremental(db)
+    else:
+        complete = load_serial(db)
+
+    if not complete:
+        sys.exit("Data download did not finish")
     print("Data download complete!")
 
 
@@ -1,67 +1,177 @@
 import os
+import sys
 import json
-import requests
+import hashlib
 import zipfile
+import argparse
+import itertools
+import ijson
+import requests
 from pymongo import MongoClient
 
+from utils.instrumentation import stage
+
 # Main variables
 BASE_URL = "https://download.open.fda.gov/drug/drugsfda/drug-drugsfda-0001-of-0001.json.zip"
 FILE_PATH = "./data_ingest/raw_data/"
 MONGO_URI = "mongodb://localhost:27017/"  # Default MongoDB location on local
 db_name = "openfda"
 collection_name = "drugs"
+BATCH_SIZE = 1000  # Records held in memory at once and sent per insert_many
+CACHE_MANIFEST = os.path.join(FILE_PATH, "fda_cache.json")  # ETag/Last-Modified/sha256 per bulk file
+
+
+def load_manifest():
+    if not os.path.exists(CACHE_MANIFEST):
+        return {}
+    with open(CACHE_MANIFEST, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest):
+    os.makedirs(FILE_PATH, exist_ok=True)
+    tmp_path = CACHE_MANIFEST + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, CACHE_MANIFEST)
 
 
-def download_fda():
+def download_fda(url=BASE_URL, force=False):
     """
-    MVP for downloading all FDA approval data
+    Download an openFDA bulk zip to raw_data, unless the cached copy is still current.
+    Sends the recorded ETag/Last-Modified as a conditional request and hashes the body,
+    so a 304 or a byte-identical republish both count as unchanged.
+    Returns (zip_file_path, sha256, changed).
+    The archive is kept zipped; records are streamed out of it by stream_fda_records.
     """
 
     # Ensure the directory exists
     os.makedirs(FILE_PATH, exist_ok=True)
 
-    # Define the local file paths
-    zip_file_path = os.path.join(FILE_PATH, "downloaded_file.zip")
+    # Define the local file path from the shard name, eg drug-drugsfda-0001-of-0001.json.zip
+    zip_file_path = os.path.join(FILE_PATH, url.rsplit("/", 1)[-1])
+
+    manifest = load_manifest()
+    entry = manifest.get(url, {})
+    cached = not force and entry and os.path.exists(zip_file_path)
+
+    headers = {}
+    if cached:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    with stage("download_fda") as metrics:
+        # Download the file
+        response = requests.get(url, headers=headers, stream=True)
+        if cached and response.status_code == 304:
+            metrics.http(nbytes=0)
+            metrics.count("not_modified")
+            print(f"{zip_file_path} is up to date (not modified since {entry.get('last_modified')})")
+            return zip_file_path, entry["sha256"], False
+        response.raise_for_status()
+
+        # Write to a temp file so an interrupted download never replaces a good cached copy
+        sha256 = hashlib.sha256()
+        tmp_path = zip_file_path + ".part"
+        nbytes = 0
+        with open(tmp_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=8192):
+                sha256.update(chunk)
+                f.write(chunk)
+                nbytes += len(chunk)
+        metrics.http(nbytes=nbytes)
+        os.replace(tmp_path, zip_file_path)
+        digest = sha256.hexdigest()
+
+    manifest[url] = {
+        **entry,
+        "path": zip_file_path,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "sha256": digest
+    }
+    save_manifest(manifest)
+
+    return zip_file_path, digest, digest != entry.get("sha256")
+
+
+def mark_loaded(url, sha256):
+    """
+    Record which archive hash is currently in MongoDB so an unchanged file isn't reloaded
+    """
 
-    # Download the file
-    response = requests.get(BASE_URL, stream=True)
-    response.raise_for_status()
+    manifest = load_manifest()
+    manifest.setdefault(url, {})["loaded_sha256"] = sha256
+    save_manifest(manifest)
 
-    with open(zip_file_path, "wb") as f:
-        for chunk in response.iter_content(chunk_size=8192):
-            f.write(chunk)
 
-    # Unzip the file
-    with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
-        zip_ref.extractall(FILE_PATH)
+def is_loaded(url, sha256):
+    return load_manifest().get(url, {}).get("loaded_sha256") == sha256
 
-    # Optional: Remove the zip file after extraction
-    os.remove(zip_file_path)
 
-    # Load the extracted JSON data
-    json_file_path = os.path.join(FILE_PATH, "drug-drugsfda-0001-of-0001.json")
-    with open(json_file_path, "r") as json_file:
-        data = json.load(json_file)
+def stream_fda_records(zip_file_path):
+    """
+    Lazily yield each record in the `results` array of every JSON member of an openFDA zip.
+    The member is decompressed and parsed incrementally, so memory does not grow with file size.
+    """
 
-    return data["results"]
+    with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
+        for member in zip_ref.namelist():
+            if not member.endswith(".json"):
+                continue
+            with zip_ref.open(member) as json_file:
+                # use_float keeps numbers BSON-encodable (ijson defaults to Decimal)
+                yield from ijson.items(json_file, "results.item", use_float=True)
 
 
 def chunk_data(data, chunk_size):
     """
-    Splits data into chunks of a specified size.
+    Splits data (a list or any iterable) into chunks of a specified size.
     """
-    for i in range(0, len(data), chunk_size):
-        yield data[i:i + chunk_size]
+    iterator = iter(data)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def load_records(collection, records, chunk_size=BATCH_SIZE):
+    """
+    Insert records in bounded batches. A failed batch is reported and skipped so the rest still load.
+    Returns (records written, batches that failed).
+    """
+
+    inserted = 0
+    failed = 0
+    for chunk in chunk_data(records, chunk_size):
+        with stage("insert_many") as metrics:
+            metrics.rows_in = len(chunk)
+            try:
+                collection.insert_many(chunk, ordered=False)
+                inserted += len(chunk)
+                metrics.rows_out = len(chunk)
+            except Exception as e:
+                failed += 1
+                metrics.count("failed_chunks")
+                print(f"Error inserting chunk: {e}")
+    return inserted, failed
 
 
 def main():
     """
     With your MongoDB instance up, upload the FDA data into your database
     """
+    parser = argparse.ArgumentParser(description='Load the openFDA drugsfda bulk file into MongoDB')
+    parser.add_argument('--force', action='store_true',
+                        help='Ignore the download cache and reload MongoDB even if the file is unchanged')
+    args = parser.parse_args()
 
-    # Download the FDA data
+    # Download the FDA data (or reuse the cached archive)
     print(f"Downloading FDA Data")
-    fda_data = download_fda()
+    zip_file_path, sha256, changed = download_fda(force=args.force)
 
     # Connect to MongoDB
     print(f"Spinning up MongoDB instance")
@@ -69,21 +179,25 @@ def main():
     db = client[db_name]
     collection = db[collection_name]
 
-    # Handle large documents by splitting them
+    if not args.force and not changed and is_loaded(BASE_URL, sha256) and collection.estimated_document_count() > 0:
+        print(f"FDA data unchanged since last load, skipping reload of '{db_name}.{collection_name}'")
+        return
+
+    # Replace the collection so reloads don't leave duplicates behind; until the load
+    # completes nothing counts as loaded
+    mark_loaded(BASE_URL, None)
+    collection.drop()
+
+    # Stream records out of the archive in batches
     print(f"Inserting FDA data into MongoDB")
-    if isinstance(fda_data, list):
-        for chunk in chunk_data(fda_data, 1000):  # Adjust chunk size as needed
-            try:
-                collection.insert_many(chunk)
-            except Exception as e:
-                print(f"Error inserting chunk: {e}")
-    else:
-        try:
-            collection.insert_one(fda_data)
-        except Exception as e:
-            print(f"Error inserting document: {e}")
+    inserted, failed = load_records(collection, stream_fda_records(zip_file_path))
+
+    # Only a complete load is recorded, so a partial one is redone on the next run
+    if failed:
+        sys.exit(f"{failed} chunk(s) failed to insert ({inserted} records loaded); rerun to reload")
+    mark_loaded(BASE_URL, sha256)
 
-    print(f"Data successfully loaded into MongoDB database '{db_name}', collection '{collection_name}'.")
+    print(f"{inserted} records successfully loaded into MongoDB database '{db_name}', collection '{collection_name}'.")
 
 
 if __name__ == "__main__":
@@ -2,19 +2,36 @@ import pandas as pd
 import yfinance as yf
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 import requests
+import pymongo
+import argparse
+import json
 import os
 from dotenv import load_dotenv
 from ratelimit import limits, sleep_and_retry
-import time 
+
+from utils import price_store
+from utils.http_cache import cached_get
+from utils import sponsor_stats
 
 @sleep_and_retry
 @limits(calls=75, period=60)
+def alpha_vantage_get(url, params=None):
+    return requests.get(url, params=params)
+
+class TickerLookupError(Exception):
+    """
+    The lookup could not get an answer (network error, rate limit, bad key), as opposed to finding no ticker
+    """
+
 
 def search_ticker_symbol(company_name: str) -> Optional[str]:
     """
     Search for a company's ticker symbol using the Alpha Vantage API.
     You need to sign up for a free API key at https://www.alphavantage.co/
+    Returns None only when the search ran and matched nothing; raises TickerLookupError otherwise.
     """
 
     load_dotenv()
@@ -29,19 +46,21 @@ def search_ticker_symbol(company_name: str) -> Optional[str]:
     }
 
     try:
-        response = requests.get(base_url, params=params)
+        # Symbol searches are cached for a month; rate limit notices (no bestMatches) are not
+        response = cached_get(base_url, params, fetch=alpha_vantage_get, cacheable=lambda r: "bestMatches" in r.json())
+        response.raise_for_status()
         data = response.json()
+    except (requests.exceptions.RequestException, ValueError) as e:
+        raise TickerLookupError(f"Alpha Vantage search failed for {company_name}: {e}") from e
 
-        if "bestMatches" in data and len(data["bestMatches"]) > 0:
-            return data["bestMatches"][0]["1. symbol"]
-    except Exception as e:
-        print(f"Error searching for {company_name}: {e}")
-
+    # Rate limit and key problems come back as a 200 with a Note/Information/Error Message instead of bestMatches
+    if "bestMatches" not in data:
+        raise TickerLookupError(data.get("Note") or data.get("Information") or data.get("Error Message") or str(data))
+    if data["bestMatches"]:
+        return data["bestMatches"][0]["1. symbol"]
     return None
 
-def get_ticker(company_name: str) -> Optional[str]:
-
-    MANUAL_MAPPING = {
+MANUAL_MAPPING = {
     "Pfizer": "PFE",
     "Johnson & Johnson": "JNJ",
     "Eli Lilly and Company": "LLY",
@@ -67,102 +86,148 @@ def get_ticker(company_name: str) -> Optional[str]:
     "Eyenovia Inc.": "EYEN",
     "Johnson & Johnson Vision Care, Inc.": "JNJ",
     "ViiV Healthcare": None,
-    "Takeda": "TAK",
-    "Pfizer": "PFE",
     "Santen Inc.": "SNPHY",
     "Alexion Pharmaceuticals, Inc.": "ALXN",
     "Merck Sharp & Dohme LLC": "MRK",
-    "Eli Lilly and Company": "LLY",
-    "AstraZeneca": "AZN",
-    }
+}
+
+MONGO_URI = "mongodb://localhost:27017/"  # Default MongoDB location on local
+clinical_trials_db = "clinical_trials_db"
+STOCK_LKUP_PATH = "./data_cleaning/processed_data/stock_lkup.csv"
+TICKER_CACHE_PATH = "./data_ingest/raw_data/ticker_cache.json"
+TICKER_TTL = timedelta(days=30)  # How long a found ticker is trusted
+NO_TICKER_TTL = timedelta(days=7)  # How long to wait before retrying a company with no ticker
+LOOKUP_WORKERS = 8  # Alpha Vantage calls are still capped at 75/min by search_ticker_symbol
+DOWNLOAD_BATCH_SIZE = 50  # Tickers per yf.download call
 
-    # Merge the dictionaries, with the df_dict taking precedence and removing dupes (case sensitive)
-    df_lookup = pd.read_csv("./data_cleaning/processed_data/stock_lkup.csv")
+
+@lru_cache(maxsize=None)
+def load_ticker_mapping() -> Dict[str, Optional[str]]:
+    """
+    MANUAL_MAPPING merged with stock_lkup.csv (the csv takes precedence), read once per process
+    """
+
+    df_lookup = pd.read_csv(STOCK_LKUP_PATH)
     df_dict = dict(zip(df_lookup['company_ct'], df_lookup['stock_ticker']))
-    MANUAL_MAPPING = {**MANUAL_MAPPING, **df_dict}
-    MANUAL_MAPPING = dict(MANUAL_MAPPING)
+    return {**MANUAL_MAPPING, **df_dict}
 
-    # Check manual mapping first
-    if company_name in MANUAL_MAPPING:
-        return MANUAL_MAPPING[company_name]
+
+def load_ticker_cache() -> Dict[str, Dict]:
+    if not os.path.exists(TICKER_CACHE_PATH):
+        return {}
+    with open(TICKER_CACHE_PATH, "r") as f:
+        return json.load(f)
+
+
+def save_ticker_cache(cache: Dict[str, Dict]):
+    os.makedirs(os.path.dirname(TICKER_CACHE_PATH), exist_ok=True)
+    tmp_path = TICKER_CACHE_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, TICKER_CACHE_PATH)
+
+
+def cached_ticker(cache: Dict[str, Dict], company_name: str):
+    """
+    Return (hit, ticker) for a cache entry that hasn't expired. Misses and negatives have their own TTL.
+    """
+
+    entry = cache.get(company_name)
+    if entry is None:
+        return False, None
+    ttl = TICKER_TTL if entry["ticker"] else NO_TICKER_TTL
+    if datetime.now() - datetime.fromisoformat(entry["resolved_at"]) > ttl:
+        return False, None
+    return True, entry["ticker"]
+
+
+def lookup_ticker(company_name: str) -> Optional[str]:
+    """
+    Resolve a company name over the network: yfinance first, then Alpha Vantage.
+    yfinance errors just fall through to Alpha Vantage, whose answer decides: None is a real
+    "not found", and a failed search raises TickerLookupError.
+    """
 
     try:
         # Try exact match first
-        ticker = yf.Ticker(company_name)
-        info = ticker.info
+        info = yf.Ticker(company_name).info
         if 'symbol' in info:
             return info['symbol']
+    except Exception as e:
+        print(f"yfinance could not find {company_name}: {e}")
 
-        # If yfinance fails, try Alpha Vantage API
-        alpha_vantage_result = search_ticker_symbol(company_name)
-        if alpha_vantage_result:
-            return alpha_vantage_result
+    # If yfinance fails, try Alpha Vantage API
+    return search_ticker_symbol(company_name)
 
+
+def get_ticker(company_name: str) -> Optional[str]:
+    # Check manual mapping first
+    mapping = load_ticker_mapping()
+    if company_name in mapping:
+        return mapping[company_name]
+
+    try:
+        return lookup_ticker(company_name)
     except Exception as e:
         print(f"Could not find ticker for {company_name}: {e}")
 
     return None
 
 def process_companies(companies: List[str]) -> Dict[str, Optional[str]]:
+    """
+    Resolve many companies at once: the mapping and the on-disk cache answer what they can,
+    and the remaining misses are looked up concurrently. Results (including misses) are cached.
+    """
+
+    mapping = load_ticker_mapping()
+    cache = load_ticker_cache()
     company_ticker_map = {}
-    for company in companies:
-        # Add wait time to avoid rate limiting
-        time.sleep(.75)
-        ticker = get_ticker(company)
-        company_ticker_map[company] = ticker
-        if ticker:
-            print(f"Found ticker for {company}: {ticker}")
+    misses = []
+    for company in dict.fromkeys(companies):
+        if company in mapping:
+            company_ticker_map[company] = mapping[company]
+            continue
+        hit, ticker = cached_ticker(cache, company)
+        if hit:
+            company_ticker_map[company] = ticker
         else:
-            print(f"No ticker found for: {company}")
+            misses.append(company)
+
+    print(f"{len(company_ticker_map)} companies resolved from the mapping and cache, looking up {len(misses)}")
+    try:
+        with ThreadPoolExecutor(max_workers=LOOKUP_WORKERS) as executor:
+            futures = {executor.submit(lookup_ticker, company): company for company in misses}
+            for future in as_completed(futures):
+                company = futures[future]
+                try:
+                    ticker = future.result()
+                except Exception as e:
+                    # Don't cache failures, only real answers
+                    print(f"Could not find ticker for {company}: {e}")
+                    company_ticker_map[company] = None
+                    continue
+                company_ticker_map[company] = ticker
+                cache[company] = {"ticker": ticker, "resolved_at": datetime.now().isoformat()}
+                if ticker:
+                    print(f"Found ticker for {company}: {ticker}")
+                else:
+                    print(f"No ticker found for: {company}")
+    finally:
+        save_ticker_cache(cache)
+
     return company_ticker_map
 
 def expand_stocks():
-    unique_sponsors = pd.read_csv("./data_cleaning/processed_data/sponsor_data.csv")
+    # Read the maintained sponsor stats; companies that only collaborate aren't looked up
+    db = pymongo.MongoClient(MONGO_URI)[clinical_trials_db]
+    unique_sponsors = sponsor_stats.load_stats(db, min_sponsor_trials=1)
     # unique_sponsors = unique_sponsors[unique_sponsors["sponsor_num_trials"] >= 500]
     unique_sponsors = unique_sponsors["company_ct"].unique().tolist()
 
     results = process_companies(unique_sponsors)
 
-    MANUAL_MAPPING = {
-    "Pfizer": "PFE",
-    "Johnson & Johnson": "JNJ",
-    "Eli Lilly and Company": "LLY",
-    "Merck": "MRK",
-    "AstraZeneca": "AZN",
-    "GlaxoSmithKline": "GSK",
-    "Novartis": "NVS",
-    "Amgen": "AMGN",
-    "Bristol-Myers Squibb": "BMY",
-    "Gilead Sciences": "GILD",
-    "Regeneron Pharmaceuticals": "REGN",
-    "Biogen": "BIIB",
-    "Vertex Pharmaceuticals": "VRTX",
-    "Moderna": "MRNA",
-    "Abbott": "ABT",
-    "Takeda": "TAK",
-    "Bayer": "BAYRY",
-    "Teva Pharmaceuticals": "TEVA",
-    "Novo Nordisk": "NVO",
-    "Sanofi": "SNY",
-    "Capricor Inc.": "CAPR",
-    "Supernus Pharmaceuticals, Inc.": "SUPN",
-    "Eyenovia Inc.": "EYEN",
-    "Johnson & Johnson Vision Care, Inc.": "JNJ",
-    "Takeda": "TAK",
-    "Pfizer": "PFE",
-    "Santen Inc.": "SNPHY",
-    "Alexion Pharmaceuticals, Inc.": "ALXN",
-    "Merck Sharp & Dohme LLC": "MRK",
-    "Eli Lilly and Company": "LLY",
-    "AstraZeneca": "AZN",
-    }
-
-    # Merge the dictionaries, second position takes precedence (ie df_dict)
-    df_lookup = pd.read_csv("./data_cleaning/processed_data/stock_lkup.csv")
-    df_dict = dict(zip(df_lookup['company_ct'], df_lookup['stock_ticker']))
-    df_dict = {**MANUAL_MAPPING, **df_dict}
-    results = {**results, **df_dict}
-    results = dict(results)
+    # Merge the dictionaries, second position takes precedence (ie the manual + csv mapping)
+    results = {**results, **load_ticker_mapping()}
 
     # Drop companies with no ticker
     results = {k: v for k, v in results.items() if v is not None}
@@ -172,31 +237,96 @@ def expand_stocks():
     
     return final_df
 
+def download_prices(tickers: List[str], start_date, end_date) -> pd.DataFrame:
+    """
+    Download closing prices for a batch of tickers in one yfinance call, as a long (date_stock, ticker, closing_price) table
+    """
+
+    data = yf.download(tickers, start=start_date, end=end_date, group_by="column", threads=True, progress=False)
+    if data.empty:
+        return pd.DataFrame(columns=["date_stock", "ticker", "closing_price"])
+
+    close = data["Close"]
+    if isinstance(close, pd.Series):
+        close = close.to_frame(tickers[0])
+    close.index.name = "date_stock"
+    long_df = close.reset_index().melt(id_vars="date_stock", var_name="ticker", value_name="closing_price")
+    return long_df.dropna(subset=["closing_price"])
+
+
+def update_prices(df_lookup: pd.DataFrame, full: bool = False) -> int:
+    """
+    Bring the price store up to date for every (company_ct, stock_ticker) in df_lookup.
+    Each (company, ticker) pair needs the days after its latest stored date, and each ticker is
+    fetched from the earliest of those across the companies using it. Tickers sharing a start
+    date are downloaded together in batches, and new rows are appended to the store.
+    Returns the number of rows appended.
+    """
+
+    # Define time range
+    end_date = pd.Timestamp(datetime.today().date())
+    history_start = end_date - timedelta(days=365*11)
+
+    if full:
+        price_store.clear()
+    else:
+        price_store.migrate_csv()
+    last_dates = price_store.last_stored_dates()
+
+    # Each company needs prices after its own last date; a ticker is fetched from its earliest need
+    pairs = df_lookup[["company_ct", "stock_ticker"]].drop_duplicates()
+    pair_start = {
+        (company, ticker): last_dates[(company, ticker)] + timedelta(days=1) if (company, ticker) in last_dates else history_start
+        for company, ticker in pairs.itertuples(index=False)
+    }
+    ticker_start = {}
+    for (company, ticker), start in pair_start.items():
+        ticker_start[ticker] = min(start, ticker_start.get(ticker, start))
+
+    tickers_by_start = {}
+    for ticker, start in ticker_start.items():
+        if start < end_date:
+            tickers_by_start.setdefault(start, []).append(ticker)
+
+    result_dfs = []
+    for start, tickers in sorted(tickers_by_start.items()):
+        for i in range(0, len(tickers), DOWNLOAD_BATCH_SIZE):
+            batch = tickers[i:i + DOWNLOAD_BATCH_SIZE]
+            print(f"Downloading {len(batch)} tickers from {start.date()}")
+            result_dfs.append(download_prices(batch, start, end_date))
+
+    if not result_dfs:
+        print("Price store is already up to date")
+        return 0
+
+    # Fan the ticker prices back out to every company using that ticker, keeping only rows it is missing
+    new_prices = pd.concat(result_dfs, ignore_index=True)
+    new_prices = new_prices.merge(pairs.rename(columns={"stock_ticker": "ticker"}), on="ticker")
+    needed_from = pd.Series(
+        [pair_start[(company, ticker)] for company, ticker in zip(new_prices["company_ct"], new_prices["ticker"])],
+        index=new_prices.index
+    )
+    new_prices = new_prices[new_prices["date_stock"] >= needed_from]
+    new_prices = new_prices[["date_stock", "company_ct", "ticker", "closing_price"]].sort_values(["ticker", "company_ct", "date_stock"])
+
+    price_store.write_prices(new_prices)
+    price_store.compact()
+    return len(new_prices)
+
+
 def main():
-    
+    parser = argparse.ArgumentParser(description='Resolve sponsor tickers and update stored closing prices')
+    parser.add_argument('--full', action='store_true',
+                        help='Rebuild the price store from scratch instead of appending the missing days')
+    args = parser.parse_args()
+
     df_lookup = expand_stocks().reset_index()
     df_lookup.to_csv("./data_ingest/raw_data/expanded_stock_lkup.csv", index=False)
 
     # df_lookup = pd.read_csv("./data_ingest/raw_data/expanded_stock_lkup.csv")
-    
-    # Define time range
-    end_date = datetime.today()
-    start_date = end_date - timedelta(days=365*11)
 
-    result_dfs = []
-    for _, row in df_lookup.iterrows():
-        ticker = row["stock_ticker"]
-        company_ct = row["company_ct"]
-        data = yf.download(ticker, start=start_date, end=end_date)
-        if not data.empty:
-            temp = data[["Close"]].reset_index()
-            temp["company_ct"] = company_ct
-            temp["ticker"] = ticker
-            temp.columns = ["date_stock", "closing_price", "company_ct", "ticker"]
-            result_dfs.append(temp[["date_stock", "company_ct", "ticker", "closing_price"]])
-
-    final_df = pd.concat(result_dfs, ignore_index=True)
-    final_df.to_csv("./data_ingest/raw_data/merged_stock_data.csv", index=False)
+    appended = update_prices(df_lookup, full=args.full)
+    print(f"Appended {appended} price rows to {price_store.PRICE_STORE_PATH}")
 
 if __name__ == "__main__":
     main()
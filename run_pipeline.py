@@ -0,0 +1,334 @@
+import os
+import sys
+import ast
+import glob
+import json
+import time
+import hashlib
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pymongo import MongoClient
+
+from utils import price_store
+from utils import instrumentation
+
+# Main variables
+MONGO_URI = "mongodb://localhost:27017/"  # Default MongoDB location on local
+STATE_PATH = "./data_cleaning/processed_data/pipeline_state.json"  # Input hashes each step last ran with
+
+# Artifacts are strings:
+#   mongo://<db>/<collection>   hashed server side with dbHash
+#   file://<path>               file contents, or every file under a directory
+#   companies://                just the company names in the price store, so new prices alone don't re-run the filters
+# A step's command is the module run with `python -m` from the repo root, then its arguments.
+# Steps marked external pull from outside APIs and always run; their own caches keep reruns cheap,
+# and downstream steps still skip when the outputs come back unchanged.
+STEPS = [
+    {
+        "name": "load_clinical_trials",
+        "command": ["data_ingest.extract_load_clinical_trials", "--mode", "sync"],
+        "inputs": [],
+        "outputs": ["mongo://clinical_trials_db/studies", "mongo://clinical_trials_db/sponsor_stats"],
+        "external": True
+    },
+    {
+        "name": "load_fda",
+        "command": ["data_ingest.extract_load_fda_approvals"],
+        "inputs": [],
+        "outputs": ["mongo://openfda/drugs"],
+        "external": True
+    },
+    {
+        "name": "sponsor_stats",
+        "command": ["data_cleaning.integrate_stock_prices"],
+        "inputs": ["mongo://clinical_trials_db/sponsor_stats"],
+        "outputs": ["file://./data_cleaning/processed_data/sponsor_data.csv"]
+    },
+    {
+        "name": "load_stocks",
+        "command": ["data_ingest.extract_load_stocks"],
+        "inputs": [
+            "mongo://clinical_trials_db/sponsor_stats",
+            "file://./data_cleaning/processed_data/stock_lkup.csv"
+        ],
+        "outputs": [
+            "file://./data_ingest/raw_data/expanded_stock_lkup.csv",
+            "file://" + price_store.PRICE_STORE_PATH
+        ],
+        "external": True
+    },
+    {
+        "name": "filter_clinical_trials",
+        "command": ["data_cleaning.filter_clinical_trials"],
+        "inputs": ["mongo://clinical_trials_db/studies", "companies://"],
+        "outputs": ["mongo://clinical_trials_db/stocks_filter"]
+    },
+    {
+        "name": "filter_fda",
+        "command": ["data_cleaning.filter_fda"],
+        "inputs": ["mongo://openfda/drugs", "companies://"],
+        "outputs": ["mongo://openfda/stocks_filter", "file://./data_cleaning/processed_data/ct_fda_lkup.csv"]
+    },
+    {
+        "name": "combine_fda_and_ct",
+        "command": ["data_cleaning.combine_fda_and_ct"],
+        "inputs": ["mongo://clinical_trials_db/stocks_filter", "mongo://openfda/stocks_filter"],
+        "outputs": ["file://./data_cleaning/processed_data/combine_fda_and_ct.parquet"]
+    },
+    {
+        "name": "filter_drugs",
+        "command": ["data_cleaning.filter_drugs"],
+        "inputs": ["file://./data_cleaning/processed_data/combine_fda_and_ct.parquet"],
+        "outputs": ["file://./data_cleaning/processed_data/filtered_drugs.parquet"]
+    },
+    {
+        "name": "make_graphs",
+        "command": ["viz.make_graphs"],
+        "inputs": ["file://./data_cleaning/processed_data/filtered_drugs.parquet", "file://" + price_store.PRICE_STORE_PATH],
+        "outputs": ["file://./data_cleaning/processed_data/price_changes.csv", "file://./viz/figures/histogram.png"]
+    }
+]
+
+
+def hash_path(path):
+    """
+    Content hash of a file, or of every file (and its relative path) under a directory. None if missing.
+    """
+    if not os.path.exists(path):
+        return None
+    if os.path.isfile(path):
+        paths = [path]
+    else:
+        paths = sorted(os.path.join(root, f) for root, _, files in os.walk(path) for f in files)
+
+    digest = hashlib.sha256()
+    for file_path in paths:
+        digest.update(os.path.relpath(file_path, path).encode())
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_artifact(client, artifact):
+    kind, location = artifact.split("://", 1)
+    if kind == "file":
+        return hash_path(location)
+    if kind == "mongo":
+        db_name, collection_name = location.split("/", 1)
+        result = client[db_name].command("dbHash", collections=[collection_name])
+        return result.get("collections", {}).get(collection_name)
+    if kind == "companies":
+        names = sorted(price_store.company_names())
+        return hashlib.sha256("\n".join(names).encode()).hexdigest()
+    raise ValueError(f"Unknown artifact type: {artifact}")
+
+
+def module_path(module):
+    """
+    Source file of a repo module, eg utils/helpers.py for utils.helpers. None if it isn't part of the repo.
+    """
+    for path in (module.replace(".", "/") + ".py", os.path.join(module.replace(".", "/"), "__init__.py")):
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def local_sources(module):
+    """
+    Source files of a module and every repo module it imports, directly or through other repo modules
+    """
+    sources = set()
+    pending = [module]
+    while pending:
+        path = module_path(pending.pop())
+        if not path or path in sources:
+            continue
+        sources.add(path)
+        with open(path, "r") as f:
+            tree = ast.parse(f.read(), filename=path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                pending.extend(alias.name for alias in node.names)
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                # `from utils import sponsor_stats` imports a module, `from utils.helpers import x` a name
+                pending.append(node.module)
+                pending.extend(f"{node.module}.{alias.name}" for alias in node.names)
+    return sorted(sources)
+
+
+def step_key(client, step):
+    """
+    Hash of the step's command, the source of its module and the repo modules it imports,
+    and the current content of its inputs
+    """
+    digest = hashlib.sha256(json.dumps(step["command"]).encode())
+    for path in local_sources(step["command"][0]):
+        digest.update(f"{path}={hash_path(path)}".encode())
+    for artifact in step["inputs"]:
+        digest.update(f"{artifact}={hash_artifact(client, artifact)}".encode())
+    return digest.hexdigest()
+
+
+def load_state():
+    if not os.path.exists(STATE_PATH):
+        return {}
+    with open(STATE_PATH, "r") as f:
+        return json.load(f)
+
+
+def save_state(state):
+    os.makedirs(os.path.dirname(STATE_PATH), exist_ok=True)
+    tmp_path = STATE_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, STATE_PATH)
+
+
+def dependencies(steps):
+    """
+    A step depends on every earlier step that produces one of its inputs
+    """
+    producers = {}
+    for step in steps:
+        for artifact in step["outputs"]:
+            producers[artifact] = step["name"]
+    # companies:// is read out of the price store
+    producers["companies://"] = producers.get("file://" + price_store.PRICE_STORE_PATH)
+    return {
+        step["name"]: {producers[a] for a in step["inputs"] if producers.get(a) and producers[a] != step["name"]}
+        for step in steps
+    }
+
+
+def run_step(step):
+    """
+    Run a step's script with this run's id so its stage report lands in the same reports folder.
+    Returns the step's wall time.
+    """
+    print(f"[{step['name']}] running python -m {' '.join(step['command'])}")
+    env = dict(os.environ, PIPELINE_RUN_ID=instrumentation.RUN_ID, PIPELINE_REPORT_DIR=instrumentation.REPORT_DIR)
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-m"] + step["command"], check=True, env=env)
+    return time.perf_counter() - start
+
+
+def write_run_report(steps, step_status):
+    """
+    Merge the per-script stage reports of this run into reports/<run id>/run_report.json
+    """
+    run_dir = os.path.join(instrumentation.REPORT_DIR, instrumentation.RUN_ID)
+    scripts = {}
+    for path in sorted(glob.glob(os.path.join(run_dir, "*.json"))):
+        if os.path.basename(path) == "run_report.json":
+            continue
+        with open(path, "r") as f:
+            script_report = json.load(f)
+        scripts[os.path.splitext(os.path.basename(path))[0]] = script_report
+
+    report = {"run_id": instrumentation.RUN_ID, "steps": {}}
+    for step in steps:
+        if step["name"] not in step_status:
+            continue
+        entry = dict(step_status[step["name"]])
+        script = step["command"][0].rsplit(".", 1)[-1]
+        if script in scripts:
+            entry["report"] = scripts[script]
+        report["steps"][step["name"]] = entry
+
+    os.makedirs(run_dir, exist_ok=True)
+    path = os.path.join(run_dir, "run_report.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Run report written to {path}")
+    return path
+
+
+def run_pipeline(steps=STEPS, only=None, force=False, workers=3, dry_run=False):
+    """
+    Run steps as soon as the steps they depend on are done, independent ones in parallel.
+    A step is skipped when its key (inputs, code and command) matches the last successful
+    run and its outputs still exist.
+    """
+    client = MongoClient(MONGO_URI)
+    state = load_state()
+    deps = dependencies(steps)
+    by_name = {step["name"]: step for step in steps}
+    selected = set(only) if only else set(by_name)
+
+    pending = [step["name"] for step in steps if step["name"] in selected]
+    done = set(by_name) - selected
+    failed = []
+    running = {}
+    step_status = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending or running:
+            # Start every step whose dependencies have finished
+            for name in list(pending):
+                if failed or not deps[name] <= done:
+                    continue
+                pending.remove(name)
+                step = by_name[name]
+                key = step_key(client, step)
+                unchanged = not force and not step.get("external") and state.get(name) == key
+                if unchanged and all(hash_artifact(client, artifact) for artifact in step["outputs"]):
+                    print(f"[{name}] inputs unchanged, skipping")
+                    step_status[name] = {"status": "skipped"}
+                    done.add(name)
+                    continue
+                if dry_run:
+                    print(f"[{name}] would run")
+                    done.add(name)
+                    continue
+                running[executor.submit(run_step, step)] = (name, key)
+
+            if not running:
+                if pending and not failed:
+                    raise RuntimeError(f"Steps with unmet dependencies: {pending}")
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, key = running.pop(future)
+                try:
+                    wall_seconds = future.result()
+                except subprocess.CalledProcessError as e:
+                    print(f"[{name}] failed with exit code {e.returncode}")
+                    step_status[name] = {"status": "failed", "returncode": e.returncode}
+                    failed.append(name)
+                    continue
+                print(f"[{name}] finished in {wall_seconds:.1f}s")
+                step_status[name] = {"status": "ran", "wall_seconds": round(wall_seconds, 3)}
+                done.add(name)
+                state[name] = key
+                save_state(state)
+
+    if step_status and not dry_run:
+        write_run_report(steps, step_status)
+
+    if failed:
+        print(f"Failed: {', '.join(failed)}; not started: {', '.join(pending) or 'none'}")
+        return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the ingest, cleaning and viz steps, skipping the ones whose inputs are unchanged')
+    parser.add_argument('--only', nargs='+', choices=[step["name"] for step in STEPS],
+                        help='Run just these steps (their upstream steps are assumed current)')
+    parser.add_argument('--force', action='store_true',
+                        help='Run every selected step even if its inputs are unchanged')
+    parser.add_argument('--workers', type=int, default=3,
+                        help='Steps allowed to run at the same time')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Print which steps would run without running them')
+    args = parser.parse_args()
+
+    ok = run_pipeline(only=args.only, force=args.force, workers=args.workers, dry_run=args.dry_run)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
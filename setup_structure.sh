@@ -9,20 +9,10 @@ brew services start mongodb-community
 
 echo "Conda env & MongoDB instance created successfully"
 
-python data_ingest/extract_load_clinical_trials.py
-python data_ingest/extract_load_fda_approvals.py
-python data_ingest/extract_load_stocks.py
-
-echo "Extracted & loaded up clinical trials, FDA approvals, and relevant stocks"
-
-python data_cleaning/filter_clinical_trials.py
-python data_cleaning/filter_fda.py
-python data_cleaning/combine_fda_and_ct.py
-python data_cleaning/filter_drugs.py
-
-echo "Filtered clinical trials & FDA approvals to only keep successful drugs"
-
-python viz/make_graphs.py
+# Extracts & loads clinical trials, FDA approvals, and relevant stocks, then filters
+# to only keep successful drugs and makes the graphs. Steps whose inputs haven't
+# changed since the last run are skipped, independent ones run in parallel.
+python run_pipeline.py
 
 echo "Check the './viz/figures/' folder for all graphs"
 
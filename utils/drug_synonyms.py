@@ -0,0 +1,136 @@
+import re
+
+# Biologics carry a four-letter FDA suffix (eg ZENOCUTUZUMAB-ZBCO) that trial registries usually leave off
+BIOLOGIC_SUFFIX_RE = re.compile(r'^([a-z]{5,})-[a-z]{4}$')
+SYMBOLS_RE = re.compile(r'[\u00ae\u2122\u00a9]')
+COMBINATION_SPLIT_RE = re.compile(r'\s+and\s+|/')
+NORMALIZER_VERSION = 1  # Bump when normalize_name, canonical_name or build_synonym_table change, so saved name indexes are rebuilt
+
+# Normalize function: lowercase, remove trademarks/copyright symbols, strip whitespace, and split combined names
+def normalize_name(name: str) -> list:
+    name = name.lower()
+    name = SYMBOLS_RE.sub('', name)  # Remove symbols: ® = ®, ™ = ™, © = ©
+    name = name.strip()
+    # Split names by " and " or "/"
+    split_names = COMBINATION_SPLIT_RE.split(name)
+    return [n.strip() for n in split_names if n.strip()]
+
+def canonical_name(name: str) -> str:
+    """
+    A normalized name with the biologic suffix removed, eg zenocutuzumab-zbco -> zenocutuzumab
+    """
+    match = BIOLOGIC_SUFFIX_RE.match(name)
+    return match.group(1) if match else name
+
+def canonical_names(name: str) -> list:
+    return [canonical_name(n) for n in normalize_name(name)]
+
+def _find(parent, name):
+    parent.setdefault(name, name)
+    root = name
+    while parent[root] != root:
+        root = parent[root]
+    # Path compression keeps later lookups flat
+    while parent[name] != root:
+        parent[name], name = root, parent[name]
+    return root
+
+def _union(parent, names):
+    names = list(names)
+    for name in names:
+        _find(parent, name)
+    for other in names[1:]:
+        a, b = _find(parent, names[0]), _find(parent, other)
+        if a != b:
+            parent[max(a, b)] = min(a, b)
+
+def _single(names):
+    """
+    The names of one raw string, or None when it splits into a combination (eg "a and b")
+    """
+    parts = canonical_names(names) if isinstance(names, str) else names
+    return parts if len(parts) == 1 else None
+
+def add_fda_synonyms(parent, fda_doc):
+    """
+    Link brand names, active ingredients and openfda substance/generic names of one application.
+    Everything is only linked together when the application has a single ingredient,
+    otherwise only each single-ingredient product's brand and ingredient are linked.
+    """
+    products = fda_doc.get("products", [])
+    openfda = fda_doc.get("openfda", {})
+
+    ingredients = set()
+    for product in products:
+        actives = [n for i in product.get("active_ingredients", []) for n in canonical_names(i.get("name", ""))]
+        brand = canonical_names(product.get("brand_name", ""))
+        ingredients.update(actives)
+        if len(set(actives)) == 1 and _single(brand):
+            _union(parent, brand + actives)
+        else:
+            for name in brand + actives:
+                _find(parent, name)
+
+    labels = [n for field in ("substance_name", "generic_name") for raw in openfda.get(field, []) for n in canonical_names(raw)]
+    ingredients.update(labels)
+    if len(ingredients) == 1:
+        brands = [n for product in products for n in canonical_names(product.get("brand_name", ""))]
+        _union(parent, list(ingredients) + labels + brands)
+    else:
+        for name in labels:
+            _find(parent, name)
+
+def add_ct_synonyms(parent, ct_doc):
+    """
+    Link each drug intervention's name with its otherNames, and with the trial's
+    MeSH intervention term when the trial tests exactly one drug against one term
+    """
+    protocol = ct_doc.get("protocolSection", {})
+    interventions = [
+        intervention for intervention in protocol.get("armsInterventionsModule", {}).get("interventions", [])
+        if intervention.get("type", "").lower() == "drug" and intervention.get("name", "").lower() != "placebo"
+    ]
+
+    drug_names = []
+    for intervention in interventions:
+        name = _single(intervention.get("name", ""))
+        other_names = [_single(other) for other in intervention.get("otherNames", [])]
+        if name:
+            _union(parent, name + [n for other in other_names if other for n in other])
+            drug_names.append(name)
+        else:
+            for n in canonical_names(intervention.get("name", "")):
+                _find(parent, n)
+
+    # The v2 API puts MeSH terms under derivedSection; older dumps had them in protocolSection
+    browse = ct_doc.get("derivedSection", {}).get("interventionBrowseModule") or protocol.get("interventionBrowseModule", {})
+    meshes = browse.get("meshes", [])
+    terms = [_single(mesh.get("term", "")) for mesh in meshes]
+    terms = [term for term in terms if term]
+    if len(drug_names) == 1 and len(terms) == 1:
+        _union(parent, drug_names[0] + terms[0])
+    else:
+        for term in terms:
+            _find(parent, term[0])
+
+def build_synonym_table(fda_docs, ct_docs):
+    """
+    Connected components of the synonym graph as {canonical name: drug id}.
+    Ids are numbered by each component's alphabetically first name so rebuilds are stable.
+    """
+    parent = {}
+    for fda_doc in fda_docs:
+        add_fda_synonyms(parent, fda_doc)
+    for ct_doc in ct_docs:
+        add_ct_synonyms(parent, ct_doc)
+
+    roots = sorted({_find(parent, name) for name in parent})
+    root_ids = {root: drug_id for drug_id, root in enumerate(roots)}
+    return {name: root_ids[_find(parent, name)] for name in parent if name}
+
+def drug_key(table, name):
+    """
+    Drug id of a normalized name. Names the table hasn't seen keep their canonical string as the key.
+    """
+    name = canonical_name(name)
+    return table.get(name, name)
@@ -0,0 +1,157 @@
+import re
+
+# A field path is dotted keys, where a key may end in
+#   []           expand a list: the field becomes a flat list of every match
+#   [name=value] take the first list element whose name equals value
+# eg "products[].active_ingredients[].name" or "submissions[submission_type=ORIG].submission_status_date"
+SEGMENT_RE = re.compile(r'^([^\[\]]+)(?:\[(?:(\w+)=([^\]]*))?\])?$')
+
+
+def parse_path(path):
+    """
+    [(key, expand, (filter key, filter value) or None), ...] for each segment of a field path
+    """
+    steps = []
+    for segment in path.split("."):
+        match = SEGMENT_RE.match(segment)
+        if not match:
+            raise ValueError(f"Bad field path segment '{segment}' in '{path}'")
+        key, filter_key, filter_value = match.groups()
+        expand = segment.endswith("]")
+        steps.append((key, expand, (filter_key, filter_value) if filter_key else None))
+    return steps
+
+
+def _append(element, out):
+    out.append(element)
+
+
+def _walk_list(steps, position=0):
+    """
+    Function (obj, out) appending every value of steps[position:] reached from obj to out
+    """
+    key, expand, filter_ = steps[position]
+    last = position == len(steps) - 1
+
+    if last and not expand:
+        def walk(obj, out):
+            out.append(obj.get(key, ''))
+        return walk
+
+    if not expand:
+        rest = _walk_list(steps, position + 1)
+
+        def walk(obj, out):
+            value = obj.get(key)
+            if isinstance(value, dict):
+                rest(value, out)
+        return walk
+
+    if last and not filter_:
+        def walk(obj, out):
+            value = obj.get(key)
+            if isinstance(value, list):
+                out.extend(value)
+        return walk
+
+    rest = _append if last else _walk_list(steps, position + 1)
+    if filter_:
+        filter_key, filter_value = filter_
+
+        def walk(obj, out):
+            value = obj.get(key)
+            if isinstance(value, list):
+                for element in value:
+                    if isinstance(element, dict) and element.get(filter_key) == filter_value:
+                        rest(element, out)
+                        return
+        return walk
+
+    def walk(obj, out):
+        value = obj.get(key)
+        if isinstance(value, list):
+            for element in value:
+                if isinstance(element, dict):
+                    rest(element, out)
+    return walk
+
+
+def _walk_single(steps, position=0):
+    """
+    Function obj -> the one value of steps[position:] reached from obj, or ""
+    """
+    key, expand, filter_ = steps[position]
+    last = position == len(steps) - 1
+
+    if last and not expand:
+        return lambda obj: obj.get(key, '')
+
+    rest = (lambda element: element) if last else _walk_single(steps, position + 1)
+    if filter_:
+        filter_key, filter_value = filter_
+
+        def walk(obj):
+            value = obj.get(key)
+            if isinstance(value, list):
+                for element in value:
+                    if isinstance(element, dict) and element.get(filter_key) == filter_value:
+                        return rest(element)
+            return ''
+        return walk
+
+    def walk(obj):
+        value = obj.get(key)
+        return rest(value) if isinstance(value, dict) else ''
+    return walk
+
+
+def compile_path(path):
+    """
+    Function doc -> value for one field path, built once from nested closures so documents
+    are walked with plain dict lookups and no per-document parsing.
+    Paths with a [] expansion return a list ("" for elements missing the last key, like
+    p.get("brand_name", "")), where a [key=value] segment contributes its first match only;
+    other paths return the value, the first filtered match, or "" when anything is missing.
+    """
+    steps = parse_path(path)
+    if any(expand and not filter_ for _, expand, filter_ in steps):
+        walk = _walk_list(steps)
+
+        def extract(doc):
+            out = []
+            walk(doc, out)
+            return out
+        return extract
+    return _walk_single(steps)
+
+
+def compile_fields(spec):
+    """
+    One function doc -> {field: value} for a {field: path} spec, compiled once
+    """
+    extractors = [(field, compile_path(path)) for field, path in spec.items()]
+
+    def extract(doc):
+        return {field: walk(doc) for field, walk in extractors}
+    return extract
+
+
+def projection(paths):
+    """
+    The minimal Mongo find() projection covering every path. Paths under an already projected
+    parent are dropped, since MongoDB rejects projections with path collisions.
+    """
+    fields = set()
+    for path in paths:
+        steps = parse_path(path)
+        for position, (_, _, filter_) in enumerate(steps):
+            # Filtered lists also need the field the filter compares
+            if filter_:
+                fields.add(".".join([key for key, _, _ in steps[:position + 1]] + [filter_[0]]))
+        fields.add(".".join(key for key, _, _ in steps))
+    fields = sorted(fields)
+    kept = []
+    for field in fields:
+        if not any(field == parent or field.startswith(parent + ".") for parent in kept):
+            kept.append(field)
+    return {field: 1 for field in kept}
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+# Date strings as the sources send them:
+#   YYYY-MM     ClinicalTrials.gov month precision
+#   YYYY-MM-DD  ClinicalTrials.gov day precision
+#   YYYYMMDD    openFDA
+# Month precision dates are placed on the first of the month.
+DASHED_DATE_RE = r'\d{4}-\d{2}(?:-\d{2})?'
+COMPACT_DATE_RE = r'\d{8}'
+DATE_CACHE_MAX = 200_000  # Distinct strings kept between calls; the cache is dropped past this
+
+_date_cache = {}
+
+
+def _parse_unique_dates(strings):
+    """
+    (datetime64[ns] array, precision array) for distinct date strings, parsed with a single to_datetime
+    """
+    s = pd.Series(strings, dtype=object).astype(str).str.strip()
+    dashed = s.str.fullmatch(DASHED_DATE_RE)
+    compact = s.str.fullmatch(COMPACT_DATE_RE)
+    month = dashed & (s.str.len() == 7)
+
+    # Rewrite every shape as YYYY-MM-DD so one format parses them all
+    canonical = s.where(dashed, s.str[:4] + '-' + s.str[4:6] + '-' + s.str[6:8])
+    canonical = canonical.where(~month, canonical + '-01').where(dashed | compact)
+    dates = pd.to_datetime(canonical, format='%Y-%m-%d', errors='coerce').to_numpy()
+    precision = np.where(np.isnat(dates), None, np.where(month, 'month', 'day'))
+    return dates, precision
+
+
+def parse_partial_dates(values):
+    """
+    DataFrame of date (datetime64[ns], NaT when missing or unparseable) and precision ("month", "day" or None)
+    for CT and FDA date strings, on the index of values. Each distinct string is parsed once and remembered,
+    since the same dates repeat across thousands of rows.
+    """
+    values = pd.Series(values)
+    codes, uniques = pd.factorize(values)
+
+    new = [value for value in uniques if value not in _date_cache]
+    if len(_date_cache) + len(new) > DATE_CACHE_MAX:
+        _date_cache.clear()
+        new = list(uniques)
+    if new:
+        _date_cache.update(zip(new, zip(*_parse_unique_dates(new))))
+
+    # Missing values factorize to -1, which picks the trailing NaT/None
+    unique_dates = np.array([_date_cache[value][0] for value in uniques] + [np.datetime64('NaT')], dtype='datetime64[ns]')
+    unique_precision = np.array([_date_cache[value][1] for value in uniques] + [None], dtype=object)
+    return pd.DataFrame({'date': unique_dates[codes], 'precision': unique_precision[codes]}, index=values.index)
@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+import requests
+
+from utils.instrumentation import stage
+
+# Responses of the endpoints below, compressed in one SQLite file shared by every script.
+# Anything not listed (eg ClinicalTrials.gov pages) is never cached.
+HTTP_CACHE_PATH = "./data_ingest/raw_data/http_cache.sqlite"
+HTTP_CACHE_MAX_BYTES = 256 * 1024 * 1024  # Compressed bodies; least recently used entries go first past this
+ENDPOINT_TTLS = {
+    "https://api.fda.gov/drug/event.json": 24 * 3600,  # New adverse event reports land daily
+    "https://api.fda.gov/drug/drugsfda.json": 7 * 24 * 3600,  # Approvals are refreshed weekly
+    "https://www.alphavantage.co/query": 30 * 24 * 3600  # Company -> ticker symbol search rarely changes
+}
+IGNORED_PARAMS = {"api_key", "apikey"}  # Never part of the key, so rotating a key keeps the cache
+
+
+def endpoint_for(url):
+    """
+    The longest ENDPOINT_TTLS prefix of a url, or None when the url isn't cached
+    """
+    matches = [endpoint for endpoint in ENDPOINT_TTLS if url.startswith(endpoint)]
+    return max(matches, key=len) if matches else None
+
+
+def cache_key(url, params=None):
+    params = sorted((k, str(v)) for k, v in (params or {}).items() if k not in IGNORED_PARAMS)
+    return hashlib.sha256(json.dumps([url, params]).encode()).hexdigest()
+
+
+class HttpCache:
+    """
+    Size-capped response cache with per-endpoint TTLs.
+    Entries past their TTL are never returned; hits and misses are counted per endpoint.
+    """
+
+    def __init__(self, path=HTTP_CACHE_PATH, max_bytes=HTTP_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.stats = {}
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY, endpoint TEXT, url TEXT, status INTEGER, headers TEXT,
+                body BLOB, size INTEGER, expires_at REAL, accessed_at REAL
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self.db.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+        self.db.commit()
+
+    def _count(self, endpoint, outcome):
+        counts = self.stats.setdefault(endpoint, {"hits": 0, "misses": 0, "stale": 0})
+        counts[outcome] += 1
+        with stage("http_cache") as metrics:
+            metrics.count(outcome)
+
+    def lookup(self, url, params=None):
+        """
+        (status, headers, body) of a fresh cached response, or None
+        """
+        endpoint = endpoint_for(url)
+        if endpoint is None:
+            return None
+        key = cache_key(url, params)
+        now = time.time()
+        with self.lock:
+            row = self.db.execute("SELECT status, headers, body, expires_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row and row[3] <= now:
+                self.db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.db.commit()
+                self._count(endpoint, "stale")
+                return None
+            if not row:
+                self._count(endpoint, "misses")
+                return None
+            self.db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self.db.commit()
+            self._count(endpoint, "hits")
+        return row[0], json.loads(row[1]), zlib.decompress(row[2])
+
+    def store(self, url, params, status, headers, body, ttl=None):
+        endpoint = endpoint_for(url)
+        ttl = ENDPOINT_TTLS.get(endpoint) if ttl is None else ttl
+        if endpoint is None or not ttl:
+            return
+        compressed = zlib.compress(body, 6)
+        # Drop transport headers that no longer describe the decompressed body
+        headers = {k: v for k, v in headers.items() if k.lower() not in ("content-encoding", "content-length", "transfer-encoding")}
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (cache_key(url, params), endpoint, url, status, json.dumps(headers), compressed, len(compressed), now + ttl, now)
+            )
+            self._evict()
+            self.db.commit()
+
+    def _evict(self):
+        """
+        Delete the least recently used entries until the cache is back under 90% of max_bytes
+        """
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = total - int(self.max_bytes * 0.9)
+        freed = 0
+        keys = []
+        for key, size in self.db.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            keys.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        self.db.executemany("DELETE FROM responses WHERE key = ?", keys)
+
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM responses")
+            self.db.commit()
+
+    def summary(self):
+        return ", ".join(f"{endpoint}: {c['hits']} hits, {c['misses']} misses, {c['stale']} stale" for endpoint, c in self.stats.items())
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    The process-wide cache, opened on first use
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = HttpCache()
+        return _cache
+
+
+def cached_get(url, params=None, ttl=None, fetch=requests.get, cacheable=None):
+    """
+    requests.get through the cache. Only 200 responses are stored, and only when cacheable(response)
+    agrees (eg to skip rate limit notices that come back as 200). fetch does the real request,
+    so a rate-limited fetch is only charged on misses.
+    """
+    cached = get_cache().lookup(url, params)
+    if cached:
+        status, headers, body = cached
+        response = requests.models.Response()
+        response.status_code = status
+        response.headers.update(headers)
+        response._content = body
+        response.url = url
+        return response
+
+    response = fetch(url, params=params)
+    if response.status_code == 200 and (cacheable is None or cacheable(response)):
+        get_cache().store(url, params, response.status_code, dict(response.headers), response.content, ttl)
+    return response
@@ -0,0 +1,199 @@
+import os
+import sys
+import json
+import time
+import atexit
+import resource
+import threading
+from datetime import datetime
+from functools import wraps
+from contextlib import contextmanager
+
+# Each script writes reports/<run id>/<script>.json; run_pipeline.py sets PIPELINE_RUN_ID so one run shares a folder
+REPORT_DIR = os.getenv("PIPELINE_REPORT_DIR", "./reports/")
+RUN_ID = os.getenv("PIPELINE_RUN_ID", datetime.now().strftime("%Y%m%d-%H%M%S"))
+RSS_SAMPLE_SECONDS = 0.05  # How often resident memory is sampled while any stage is running
+
+_lock = threading.Lock()
+_stages = {}
+_watches = set()
+_started = time.time()
+_report_registered = False
+_sampler = None
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of this process so far (ru_maxrss is KB on Linux, bytes on macOS)
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def current_rss_mb():
+    """
+    Resident memory right now, from /proc on Linux. Elsewhere falls back to the process peak,
+    so memory watches only see growth past the earlier high-water mark.
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb()
+
+
+class MemoryWatch:
+    """
+    Resident memory over a block: rss at the start and the highest sample while it ran
+    """
+
+    def __init__(self):
+        self.start_rss_mb = self.peak_rss_mb = current_rss_mb()
+
+    def sample(self, rss):
+        self.peak_rss_mb = max(self.peak_rss_mb, rss)
+
+    @property
+    def rss_growth_mb(self):
+        return self.peak_rss_mb - self.start_rss_mb
+
+
+def _sample_rss():
+    while True:
+        time.sleep(RSS_SAMPLE_SECONDS)
+        with _lock:
+            if not _watches:
+                continue
+            watches = list(_watches)
+        rss = current_rss_mb()
+        for watch in watches:
+            watch.sample(rss)
+
+
+@contextmanager
+def memory_watch():
+    """
+    Track the peak resident memory of a block with a background sampler (plus a sample at each end)
+    """
+    global _sampler
+    watch = MemoryWatch()
+    with _lock:
+        if _sampler is None:
+            _sampler = threading.Thread(target=_sample_rss, daemon=True)
+            _sampler.start()
+        _watches.add(watch)
+    try:
+        yield watch
+    finally:
+        with _lock:
+            _watches.discard(watch)
+        watch.sample(current_rss_mb())
+
+
+class Stage:
+    """
+    Counters for one execution of a stage. Set rows_in/rows_out and call http()/count() while it runs.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.rows_in = 0
+        self.rows_out = 0
+        self.http_requests = 0
+        self.http_bytes = 0
+        self.counters = {}
+
+    def http(self, response=None, nbytes=None):
+        """
+        Count one request. Pass the response for a normal call, or nbytes for a streamed body.
+        """
+        self.http_requests += 1
+        if nbytes is None and response is not None:
+            nbytes = len(response.content)
+        self.http_bytes += nbytes or 0
+
+    def count(self, key, n=1):
+        self.counters[key] = self.counters.get(key, 0) + n
+
+
+def _record(stage, wall_seconds, memory):
+    with _lock:
+        totals = _stages.setdefault(stage.name, {
+            "calls": 0, "wall_seconds": 0.0, "max_wall_seconds": 0.0, "rows_in": 0, "rows_out": 0,
+            "http_requests": 0, "http_bytes": 0, "peak_rss_mb": 0.0, "rss_growth_mb": 0.0, "counters": {}
+        })
+        totals["calls"] += 1
+        totals["wall_seconds"] += wall_seconds
+        totals["max_wall_seconds"] = max(totals["max_wall_seconds"], wall_seconds)
+        totals["rows_in"] += stage.rows_in
+        totals["rows_out"] += stage.rows_out
+        totals["http_requests"] += stage.http_requests
+        totals["http_bytes"] += stage.http_bytes
+        # RSS sampled while this stage ran, and the most it rose above its starting point in any one call
+        totals["peak_rss_mb"] = round(max(totals["peak_rss_mb"], memory.peak_rss_mb), 1)
+        totals["rss_growth_mb"] = round(max(totals["rss_growth_mb"], memory.rss_growth_mb), 1)
+        for key, n in stage.counters.items():
+            totals["counters"][key] = totals["counters"].get(key, 0) + n
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a block and record its counters under `name`. Repeated stages (eg one per page) are summed.
+    """
+    _register_report()
+    current = Stage(name)
+    start = time.perf_counter()
+    with memory_watch() as memory:
+        try:
+            yield current
+        finally:
+            memory.sample(current_rss_mb())
+            _record(current, time.perf_counter() - start, memory)
+
+
+def instrument(name=None):
+    """
+    Decorator form of stage() for functions that don't need to report rows or bytes
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def report():
+    with _lock:
+        return {
+            "run_id": RUN_ID,
+            "script": os.path.basename(sys.argv[0]),
+            "started_at": datetime.fromtimestamp(_started).isoformat(),
+            "wall_seconds": round(time.time() - _started, 3),
+            "process_peak_rss_mb": round(peak_rss_mb(), 1),
+            "stages": {name: dict(totals) for name, totals in _stages.items()}
+        }
+
+
+def write_report():
+    """
+    Write this process's stage totals to reports/<run id>/<script>.json
+    """
+    if not _stages:
+        return None
+    run_dir = os.path.join(REPORT_DIR, RUN_ID)
+    os.makedirs(run_dir, exist_ok=True)
+    script = os.path.splitext(os.path.basename(sys.argv[0]))[0] or "interactive"
+    path = os.path.join(run_dir, f"{script}.json")
+    with open(path, "w") as f:
+        json.dump(report(), f, indent=2)
+    return path
+
+
+def _register_report():
+    global _report_registered
+    if not _report_registered:
+        _report_registered = True
+        atexit.register(write_report)
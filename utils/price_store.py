@@ -0,0 +1,116 @@
+import os
+import glob
+import shutil
+import pandas as pd
+
+# Closing prices as a parquet dataset partitioned by ticker, eg stock_prices/ticker=PFE/*.parquet
+PRICE_STORE_PATH = "./data_ingest/raw_data/stock_prices/"
+LEGACY_CSV_PATH = "./data_ingest/raw_data/merged_stock_data.csv"
+PRICE_COLUMNS = ["date_stock", "company_ct", "ticker", "closing_price"]
+MAX_FILES_PER_TICKER = 20  # Daily appends each add a file; past this a partition is rewritten as one
+
+
+def exists():
+    return os.path.isdir(PRICE_STORE_PATH) and bool(glob.glob(os.path.join(PRICE_STORE_PATH, "ticker=*")))
+
+
+def _typed(df):
+    """
+    Cast to the store schema: datetime dates, float64 prices and category-encoded names
+    """
+
+    df = df[PRICE_COLUMNS].copy()
+    df["date_stock"] = pd.to_datetime(df["date_stock"])
+    df["company_ct"] = df["company_ct"].astype("category")
+    df["ticker"] = df["ticker"].astype(str)
+    df["closing_price"] = df["closing_price"].astype("float64")
+    return df
+
+
+def write_prices(df):
+    """
+    Append rows to the store. Each call adds new files to the touched ticker partitions.
+    """
+
+    if df.empty:
+        return
+    os.makedirs(PRICE_STORE_PATH, exist_ok=True)
+    _typed(df).to_parquet(PRICE_STORE_PATH, partition_cols=["ticker"], index=False)
+
+
+def read_prices(columns=None, tickers=None, companies=None, start=None, end=None):
+    """
+    Read only the requested columns, pushing the ticker/company/date predicates down
+    to parquet so unrelated partitions and row groups are never decoded.
+    """
+
+    if not exists():
+        return pd.DataFrame(columns=columns or PRICE_COLUMNS)
+
+    filters = []
+    if tickers is not None:
+        filters.append(("ticker", "in", list(tickers)))
+    if companies is not None:
+        filters.append(("company_ct", "in", list(companies)))
+    if start is not None:
+        filters.append(("date_stock", ">=", pd.Timestamp(start)))
+    if end is not None:
+        filters.append(("date_stock", "<=", pd.Timestamp(end)))
+
+    return pd.read_parquet(PRICE_STORE_PATH, columns=columns, filters=filters or None)
+
+
+def company_names():
+    """
+    Unique company_ct values in the store, reading just that one dictionary-encoded column
+    """
+
+    return read_prices(columns=["company_ct"])["company_ct"].dropna().unique().tolist()
+
+
+def last_stored_dates():
+    """
+    Latest stored date for each (company_ct, ticker) pair
+    """
+
+    stored = read_prices(columns=["date_stock", "company_ct", "ticker"])
+    if stored.empty:
+        return {}
+    stored["company_ct"] = stored["company_ct"].astype(str)
+    stored["ticker"] = stored["ticker"].astype(str)
+    return stored.groupby(["company_ct", "ticker"])["date_stock"].max().to_dict()
+
+
+def compact(max_files=MAX_FILES_PER_TICKER):
+    """
+    Rewrite any ticker partition that has accumulated too many small append files as a single file
+    """
+
+    for partition in glob.glob(os.path.join(PRICE_STORE_PATH, "ticker=*")):
+        files = glob.glob(os.path.join(partition, "*.parquet"))
+        if len(files) <= max_files:
+            continue
+        df = pd.concat([pd.read_parquet(f) for f in files], ignore_index=True)
+        df = df.drop_duplicates(subset=["date_stock", "company_ct"]).sort_values(["company_ct", "date_stock"])
+        tmp_file = os.path.join(partition, "compacted.parquet.tmp")
+        df.to_parquet(tmp_file, index=False)
+        for f in files:
+            os.remove(f)
+        os.replace(tmp_file, os.path.join(partition, "part-0.parquet"))
+
+
+def clear():
+    if os.path.isdir(PRICE_STORE_PATH):
+        shutil.rmtree(PRICE_STORE_PATH)
+
+
+def migrate_csv(csv_path=LEGACY_CSV_PATH):
+    """
+    One-off conversion of an existing merged_stock_data.csv into the partitioned store
+    """
+
+    if exists() or not os.path.exists(csv_path):
+        return False
+    print(f"Converting {csv_path} into {PRICE_STORE_PATH}")
+    write_prices(pd.read_csv(csv_path))
+    return True
@@ -0,0 +1,159 @@
+from collections import Counter
+from datetime import datetime
+import pandas as pd
+from pymongo import UpdateOne
+
+from utils.instrumentation import stage
+
+# Trials per industry company as lead sponsor and as collaborator, kept in its own collection next to
+# the studies. One $facet pass builds it after a full load; upserted studies adjust it by their difference.
+# A marker in ingest_state says the table was seeded from every study; without it, deltas would land on a
+# missing or stale table, so readers and updaters rebuild first.
+SPONSOR_STATS_COLLECTION = "sponsor_stats"
+STUDIES_COLLECTION = "studies"
+STATE_COLLECTION = "ingest_state"
+SPONSOR_FIELD = "protocolSection.sponsorCollaboratorsModule.leadSponsor"
+COLLABORATORS_FIELD = "protocolSection.sponsorCollaboratorsModule.collaborators"
+NCT_ID_FIELD = "protocolSection.identificationModule.nctId"
+STATS_COLUMNS = ["company_ct", "sponsor_num_trials", "collab_num_trials", "total_num_trials"]
+
+# Only the two sponsor fields enter the $facet, so the single facet document stays small
+FACET_PIPELINE = [
+    {"$project": {"sponsor": "$" + SPONSOR_FIELD, "collaborators": "$" + COLLABORATORS_FIELD, "_id": 0}},
+    {"$facet": {
+        "sponsor_num_trials": [
+            {"$match": {"sponsor.class": "INDUSTRY", "sponsor.name": {"$type": "string"}}},
+            {"$group": {"_id": "$sponsor.name", "trials": {"$sum": 1}}}
+        ],
+        "collab_num_trials": [
+            {"$unwind": "$collaborators"},
+            {"$match": {"collaborators.class": "INDUSTRY", "collaborators.name": {"$type": "string"}}},
+            {"$group": {"_id": "$collaborators.name", "trials": {"$sum": 1}}}
+        ]
+    }}
+]
+
+
+def is_built(db):
+    marker = db[STATE_COLLECTION].find_one({"_id": SPONSOR_STATS_COLLECTION}) or {}
+    return bool(marker.get("built"))
+
+
+def invalidate(db):
+    """
+    Mark the stats as no longer matching the studies, eg when a load starts or a write fails partway
+    """
+    db[STATE_COLLECTION].update_one({"_id": SPONSOR_STATS_COLLECTION}, {"$set": {"built": False}}, upsert=True)
+
+
+def rebuild(collection):
+    """
+    Recompute the stats of a studies collection in one aggregation, swap them in and mark them built.
+    Returns the number of companies.
+    """
+
+    with stage("sponsor_stats_rebuild") as metrics:
+        facets = next(collection.aggregate(FACET_PIPELINE, allowDiskUse=True), {})
+        stats = {}
+        for field in ("sponsor_num_trials", "collab_num_trials"):
+            for group in facets.get(field, []):
+                doc = stats.setdefault(group["_id"], {"_id": group["_id"], "company_ct": group["_id"],
+                                                      "sponsor_num_trials": 0, "collab_num_trials": 0})
+                doc[field] = group["trials"]
+        for doc in stats.values():
+            doc["total_num_trials"] = doc["sponsor_num_trials"] + doc["collab_num_trials"]
+
+        # Build next to the live collection and rename over it, so readers never see a partial table
+        staging = collection.database[SPONSOR_STATS_COLLECTION + "_staging"]
+        staging.drop()
+        if stats:
+            staging.insert_many(list(stats.values()))
+            staging.rename(SPONSOR_STATS_COLLECTION, dropTarget=True)
+        else:
+            collection.database[SPONSOR_STATS_COLLECTION].drop()
+        collection.database[STATE_COLLECTION].update_one(
+            {"_id": SPONSOR_STATS_COLLECTION},
+            {"$set": {"built": True, "built_at": datetime.now().isoformat(), "companies": len(stats)}},
+            upsert=True
+        )
+        metrics.rows_out = len(stats)
+    return len(stats)
+
+
+def study_counts(study):
+    """
+    Counter of (company, field) -> trials one study adds, matching FACET_PIPELINE
+    """
+
+    module = study.get("protocolSection", {}).get("sponsorCollaboratorsModule", {})
+    counts = Counter()
+    sponsor = module.get("leadSponsor") or {}
+    if sponsor.get("class") == "INDUSTRY" and isinstance(sponsor.get("name"), str):
+        counts[(sponsor["name"], "sponsor_num_trials")] += 1
+    for collaborator in module.get("collaborators") or []:
+        if collaborator.get("class") == "INDUSTRY" and isinstance(collaborator.get("name"), str):
+            counts[(collaborator["name"], "collab_num_trials")] += 1
+    return counts
+
+
+def previous_counts(collection, studies):
+    """
+    Counts of the stored versions of studies, read before they are replaced
+    """
+
+    nct_ids = [study["protocolSection"]["identificationModule"]["nctId"] for study in studies]
+    counts = Counter()
+    for doc in collection.find({NCT_ID_FIELD: {"$in": nct_ids}}, {SPONSOR_FIELD: 1, COLLABORATORS_FIELD: 1}):
+        counts.update(study_counts(doc))
+    return counts
+
+
+def apply_changes(collection, before, studies):
+    """
+    Move the stats from `before` (previous_counts) to the counts of the upserted studies.
+    Companies left with no trials are removed. When the stats were never built (or were invalidated)
+    they are rebuilt instead, since the upserted studies are already in the collection.
+    """
+    if not is_built(collection.database):
+        print("Sponsor stats are missing or stale, rebuilding them")
+        rebuild(collection)
+        return 0
+
+    changes = Counter()
+    for study in studies:
+        changes.update(study_counts(study))
+    changes.subtract(before)
+
+    operations = [
+        UpdateOne({"_id": company}, {"$inc": {field: n, "total_num_trials": n}, "$set": {"company_ct": company}}, upsert=True)
+        for (company, field), n in changes.items() if n
+    ]
+    if not operations:
+        return 0
+
+    stats = collection.database[SPONSOR_STATS_COLLECTION]
+    with stage("sponsor_stats_update") as metrics:
+        metrics.rows_in = len(operations)
+        try:
+            stats.bulk_write(operations, ordered=False)
+            stats.delete_many({"total_num_trials": {"$lte": 0}})
+        except Exception:
+            # Some increments may have landed; have the next reader recount
+            invalidate(collection.database)
+            raise
+    return len(operations)
+
+
+def load_stats(db, min_sponsor_trials=0):
+    """
+    The stats as a DataFrame (STATS_COLUMNS), most sponsored trials first. Rebuilt first when missing or stale.
+    """
+    if not is_built(db):
+        print("Sponsor stats are missing or stale, rebuilding them")
+        rebuild(db[STUDIES_COLLECTION])
+
+    query = {"sponsor_num_trials": {"$gte": min_sponsor_trials}} if min_sponsor_trials else {}
+    docs = db[SPONSOR_STATS_COLLECTION].find(query, {"_id": 0})
+    df = pd.DataFrame(list(docs), columns=STATS_COLUMNS)
+    df[STATS_COLUMNS[1:]] = df[STATS_COLUMNS[1:]].fillna(0).astype(int)
+    return df.sort_values(["sponsor_num_trials", "company_ct"], ascending=[False, True], ignore_index=True)
@@ -1,4 +1,6 @@
 import pandas as pd
+import matplotlib
+matplotlib.use('Agg')  # Render to files only, also inside the plotting worker processes
 import matplotlib.pyplot as plt
 import seaborn as sns
 import plotly.graph_objects as go
@@ -7,23 +9,37 @@ from plotly.subplots import make_subplots
 import datetime
 import argparse
 import os
+import json
+import hashlib
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
-def load_data(stock_path, drugs_path):
+from utils import price_store
+from utils.instrumentation import stage, instrument
+
+# Event windows are found by searching one sorted int64 key per price: company code * stride + day number
+KEY_STRIDE = 1_000_000
+DAY_OFFSET = 500_000  # Keeps day numbers before 1970 positive
+
+LINE_GRAPHS_DIR = './viz/figures/line_graphs/'
+PLOT_MANIFEST = os.path.join(LINE_GRAPHS_DIR, 'manifest.json')  # filename -> hash of the data it was drawn from
+PLOT_VERSION = '1'  # Bump when create_seaborn_plot changes so every figure is redrawn
+PLOT_ROW_FIELDS = ['fda_company', 'fda_date', 'ct_date', 'ct_phase', 'matched_drug_names', 'fda_id', 'ct_id']
+
+def load_data(drugs_path):
     """Load and preprocess stock and drug data"""
-    stocks = pd.read_csv(stock_path)
-    drugs = pd.read_csv(drugs_path)
-    
-    # Convert date columns
-    drugs['fda_date'] = pd.to_datetime(drugs['fda_date'])
-    drugs['ct_date'] = pd.to_datetime(drugs['ct_date'])
-    stocks['date_stock'] = pd.to_datetime(stocks['date_stock'])
+    # Typed parquet from filter_drugs: dates are already datetimes and list columns are arrays
+    drugs = pd.read_parquet(drugs_path)
+
+    # Only read prices for companies with drugs, already typed by the price store
+    stocks = price_store.read_prices(companies=drugs['fda_company'].dropna().unique())
     
     return stocks, drugs
 
 def filter_drugs(drugs_df, limit_to_companies_with_X_or_fewer_drugs=1000):
     """Filter and sample drugs data"""
     filtered = drugs_df.dropna(subset=['fda_company', 'fda_date', 'ct_date', 'ct_phase', 'matched_drug_names'])
+    filtered = filtered[(filtered['ct_phase'].map(len) > 0) & (filtered['matched_drug_names'].map(len) > 0)]
     filtered = filtered.sort_values(by=['fda_company', 'fda_id', 'ct_date']).drop_duplicates(subset=['fda_id'], keep='last')
     filtered = filtered[filtered['fda_company'].isin(
         filtered['fda_company'].value_counts()[filtered['fda_company'].value_counts() <= limit_to_companies_with_X_or_fewer_drugs].index
@@ -31,6 +47,67 @@ def filter_drugs(drugs_df, limit_to_companies_with_X_or_fewer_drugs=1000):
     
     return filtered
 
+def build_price_index(stocks):
+    """
+    Sort prices by (company, date) once so that any company's date window is a contiguous
+    slice found with searchsorted. Cumulative sums turn window averages into two lookups.
+    """
+    companies = pd.Index(stocks['company_ct'].astype(str).unique())
+    codes = companies.get_indexer(stocks['company_ct'].astype(str)).astype(np.int64)
+    days = stocks['date_stock'].to_numpy().astype('datetime64[D]').astype(np.int64)
+    keys = codes * KEY_STRIDE + days + DAY_OFFSET
+
+    order = np.argsort(keys, kind='stable')
+    sorted_stocks = stocks.iloc[order].reset_index(drop=True)
+    prices = sorted_stocks['closing_price'].to_numpy(dtype=float)
+    has_price = ~np.isnan(prices)
+
+    return {
+        'stocks': sorted_stocks,
+        'companies': companies,
+        'keys': keys[order],
+        'cum_price': np.concatenate([[0.0], np.cumsum(np.where(has_price, prices, 0.0))]),
+        'cum_count': np.concatenate([[0], np.cumsum(has_price)])
+    }
+
+def window_bounds(price_index, companies, dates, start_days, end_days):
+    """Row positions [lo, hi) in the sorted prices for each company's [date + start_days, date + end_days] window"""
+    codes = price_index['companies'].get_indexer(pd.Series(companies).astype(str)).astype(np.int64)
+    dates = pd.to_datetime(pd.Series(dates)).to_numpy()
+    days = dates.astype('datetime64[D]').astype(np.int64)
+    base = codes * KEY_STRIDE + days + DAY_OFFSET
+
+    lo = np.searchsorted(price_index['keys'], base + start_days, side='left')
+    hi = np.searchsorted(price_index['keys'], base + end_days, side='right')
+
+    # Unknown companies and missing dates get an empty window
+    invalid = (codes < 0) | np.isnat(dates)
+    lo[invalid] = 0
+    hi[invalid] = 0
+    return lo, hi
+
+def window_mean(price_index, lo, hi):
+    """Average closing price within each window, NaN where the window has no prices"""
+    total = price_index['cum_price'][hi] - price_index['cum_price'][lo]
+    count = price_index['cum_count'][hi] - price_index['cum_count'][lo]
+    return np.divide(total, count, out=np.full(len(total), np.nan), where=count > 0)
+
+def compute_event_prices(price_index, events):
+    """
+    Add ct_avg_price, fda_avg_price (mean close over the 7 days from each date)
+    and price_pct_change to every event at once
+    """
+    events = events.copy()
+    ct_lo, ct_hi = window_bounds(price_index, events['fda_company'], events['ct_date'], 0, 7)
+    fda_lo, fda_hi = window_bounds(price_index, events['fda_company'], events['fda_date'], 0, 7)
+    events['ct_avg_price'] = window_mean(price_index, ct_lo, ct_hi)
+    events['fda_avg_price'] = window_mean(price_index, fda_lo, fda_hi)
+    events['price_pct_change'] = (events['fda_avg_price'] - events['ct_avg_price']) / events['ct_avg_price'] * 100
+    return events
+
+def drug_names(row):
+    return ', '.join(row['matched_drug_names'])
+
 def create_plotly_figure(company_stocks, row):
     """Create a Plotly figure for a single drug"""
     
@@ -58,7 +135,7 @@ def create_plotly_figure(company_stocks, row):
     # Add CT date line if within range
     start_date = row['fda_date'] - pd.Timedelta(days=365)
     end_date = row['fda_date'] + pd.Timedelta(days=20)
-    ct_phase = str(row.ct_phase).replace("'", "").replace("[", "").replace("]", "")
+    ct_phase = ', '.join(row.ct_phase)
     if start_date <= row['ct_date'] <= end_date:
         fig.add_vline(
             x=row['ct_date'].timestamp() * 1000,
@@ -71,8 +148,8 @@ def create_plotly_figure(company_stocks, row):
     ticker = company_stocks['ticker'].iloc[0] if not company_stocks['ticker'].empty else 'Unknown'
     fig.update_layout(
         title={
-            'text': (f'{row["fda_company"]} ({ticker}): {row["matched_drug_names"]}<br>' +
-                    f'<a href="https://www.google.com/search?q=fda%20approval%20{row["fda_company"]}%20{row["matched_drug_names"]}">Google Search for FDA</a> | ' +
+            'text': (f'{row["fda_company"]} ({ticker}): {drug_names(row)}<br>' +
+                    f'<a href="https://www.google.com/search?q=fda%20approval%20{row["fda_company"]}%20{drug_names(row)}">Google Search for FDA</a> | ' +
                     f'<a href="https://clinicaltrials.gov/study/{row["ct_id"]}">Clinical Trial</a>'),
             'xanchor': 'center',
             'x': 0.5
@@ -88,7 +165,56 @@ def create_plotly_figure(company_stocks, row):
     
     return fig
 
-def create_seaborn_plot(company_stocks, row):
+def plot_filename(company_stocks, row):
+    """Figure path built from the company, ticker, drug and trial"""
+    ticker = company_stocks['ticker'].iloc[0] if not company_stocks['ticker'].empty else 'Unknown'
+    clean_drug_name = drug_names(row).replace('/', '_').replace(' ', '_').replace(',', '')
+    return f'{LINE_GRAPHS_DIR}{row["fda_company"]}_{ticker}_{clean_drug_name}_{row["ct_id"]}.png'
+
+def plot_hash(company_stocks, row):
+    """Content hash of everything a figure is drawn from"""
+    digest = hashlib.sha256(PLOT_VERSION.encode())
+    prices = company_stocks[['date_stock', 'closing_price']]
+    digest.update(pd.util.hash_pandas_object(prices, index=False).to_numpy().tobytes())
+    digest.update(repr([str(list(row[field])) if isinstance(row[field], np.ndarray) else str(row[field]) for field in PLOT_ROW_FIELDS]).encode())
+    return digest.hexdigest()
+
+def _render_seaborn_job(job):
+    company_stocks, row, filename = job
+    return create_seaborn_plot(company_stocks, row, filename)
+
+def render_seaborn_plots(jobs, workers=None, force=False):
+    """
+    Draw (company_stocks, row) jobs in a process pool, skipping figures whose
+    file exists and whose input data hashes the same as when it was last drawn
+    """
+    manifest = {}
+    if os.path.exists(PLOT_MANIFEST) and not force:
+        with open(PLOT_MANIFEST, 'r') as f:
+            manifest = json.load(f)
+
+    pending = []
+    hashes = {}
+    for company_stocks, row in jobs:
+        filename = plot_filename(company_stocks, row)
+        hashes[filename] = plot_hash(company_stocks, row)
+        if manifest.get(filename) == hashes[filename] and os.path.exists(filename):
+            continue
+        pending.append((company_stocks, row, filename))
+
+    print(f"Drawing {len(pending)} figures, {len(hashes) - len(pending)} unchanged")
+    os.makedirs(LINE_GRAPHS_DIR, exist_ok=True)
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for filename in executor.map(_render_seaborn_job, pending, chunksize=4):
+                if filename:
+                    manifest[filename] = hashes[filename]
+
+    with open(PLOT_MANIFEST, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return len(pending)
+
+def create_seaborn_plot(company_stocks, row, filename=None):
     """Create a Seaborn plot for a single drug and save to file"""
 
     # Check to see if there is any data
@@ -105,14 +231,14 @@ def create_seaborn_plot(company_stocks, row):
     # Add CT date line if within range
     start_date = row['fda_date'] - pd.Timedelta(days=365)
     end_date = row['fda_date'] + pd.Timedelta(days=20)
-    ct_phase = str(row.ct_phase).replace("'", "").replace("[", "").replace("]", "")
+    ct_phase = ', '.join(row.ct_phase)
     if start_date <= row['ct_date'] <= end_date:
         plt.axvline(x=row['ct_date'], color='midnightblue', linestyle='--',
                     label=f'{ct_phase} completed on {row["ct_date"].strftime("%Y-%m-%d")}')
     
     # Add ticker to title
     ticker = company_stocks['ticker'].iloc[0] if not company_stocks['ticker'].empty else 'Unknown'
-    plt.title(f'{row["fda_company"]} ({ticker}): {row["matched_drug_names"]} \n FDA Application: {row["fda_id"]} | Clinical Trial: {row["ct_id"]}')
+    plt.title(f'{row["fda_company"]} ({ticker}): {drug_names(row)} \n FDA Application: {row["fda_id"]} | Clinical Trial: {row["ct_id"]}')
     
     plt.xlabel('')
     plt.ylabel('Stock Price ($)')
@@ -127,11 +253,11 @@ def create_seaborn_plot(company_stocks, row):
     plt.tight_layout()
     
     # Create figures directory if it doesn't exist
-    os.makedirs('./viz/figures/line_graphs/', exist_ok=True)
+    os.makedirs(LINE_GRAPHS_DIR, exist_ok=True)
     
     # Create filename using relevant information
-    clean_drug_name = row["matched_drug_names"].replace('/', '_').replace(' ', '_').replace(',', '')
-    filename = f'./viz/figures/line_graphs/{row["fda_company"]}_{ticker}_{clean_drug_name}_{row["ct_id"]}.png'
+    if filename is None:
+        filename = plot_filename(company_stocks, row)
     
     # Save figure
     plt.savefig(filename, dpi=300, bbox_inches='tight')
@@ -139,74 +265,58 @@ def create_seaborn_plot(company_stocks, row):
     
     return filename
 
+@instrument("make_graphs")
 def main():
     parser = argparse.ArgumentParser(description='Plot stock time series data')
-    stock_path = './data_ingest/raw_data/merged_stock_data.csv'
-    drugs_path = './data_cleaning/processed_data/filtered_drugs.csv'
+    drugs_path = './data_cleaning/processed_data/filtered_drugs.parquet'
     parser.add_argument('--plots', choices=['plotly', 'seaborn', 'both'], default='seaborn',
                         help='Type of plot to generate')
     parser.add_argument('--limit', type=int, default=1000,
                         help='Limit to companies with X or fewer drugs')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Processes used to draw seaborn figures (default: one per CPU)')
+    parser.add_argument('--redraw', action='store_true',
+                        help='Redraw every figure even if its data has not changed')
     args = parser.parse_args()
     
     # Load and process data
-    stocks, drugs = load_data(stock_path, drugs_path)
-    filtered_drugs = filter_drugs(drugs, args.limit)
+    with stage("load_data") as metrics:
+        stocks, drugs = load_data(drugs_path)
+        filtered_drugs = filter_drugs(drugs, args.limit)
+        metrics.rows_in = len(drugs)
+        metrics.rows_out = len(filtered_drugs)
+        metrics.count("price_rows", len(stocks))
 
-    # New code for histogram
-    processed_data = []
-    
-    # Iterate over each drug entry
-    for _, row in filtered_drugs.iterrows():
-        start_date = row['fda_date'] - pd.Timedelta(days=180)
-        end_date = row['fda_date'] + pd.Timedelta(days=10)
-        
-        # Filter stock data
-        company_stocks = stocks[
-            (stocks['company_ct'] == row['fda_company']) & 
-            (stocks['date_stock'] >= start_date) & 
-            (stocks['date_stock'] <= end_date)
-        ]
-        
-        if len(company_stocks) == 0:
-            continue
+    # Index prices once and compute every event window in one vectorized pass
+    with stage("event_prices") as metrics:
+        price_index = build_price_index(stocks)
+        processed_df = compute_event_prices(price_index, filtered_drugs)
+        metrics.rows_in = metrics.rows_out = len(processed_df)
+
+    # Only keep drugs with prices around the FDA date (180 days before to 10 days after)
+    plot_lo, plot_hi = window_bounds(price_index, processed_df['fda_company'], processed_df['fda_date'], -180, 10)
+    has_prices = plot_hi > plot_lo
+    processed_df = processed_df[has_prices]
+    plot_lo, plot_hi = plot_lo[has_prices], plot_hi[has_prices]
+
+    # Iterate over each drug entry, collecting the seaborn figures to draw in parallel
+    seaborn_jobs = []
+    for (_, row), lo, hi in zip(processed_df.iterrows(), plot_lo, plot_hi):
+        company_stocks = price_index['stocks'].iloc[lo:hi]
             
         if args.plots in ['plotly', 'both']:
             fig = create_plotly_figure(company_stocks, row)
             fig.show()
             
         if args.plots in ['seaborn', 'both']:
-            filename = create_seaborn_plot(company_stocks, row)
+            seaborn_jobs.append((company_stocks, row))
 
-        # Get 7 day windows after each date
-        ct_window = pd.date_range(row['ct_date'], row['ct_date'] + pd.Timedelta(days=7))
-        fda_window = pd.date_range(row['fda_date'], row['fda_date'] + pd.Timedelta(days=7))
+    if seaborn_jobs:
+        with stage("render_seaborn_plots") as metrics:
+            metrics.rows_in = len(seaborn_jobs)
+            render_seaborn_plots(seaborn_jobs, workers=args.workers, force=args.redraw)
 
-        # Get price data for windows
-        ct_prices = stocks[
-            (stocks['company_ct'] == row['fda_company']) & 
-            (stocks['date_stock'].isin(ct_window))
-        ]['closing_price']
-        
-        fda_prices = stocks[
-            (stocks['company_ct'] == row['fda_company']) & 
-            (stocks['date_stock'].isin(fda_window))
-        ]['closing_price']
-        
-        # Create row dictionary with all original data
-        row_dict = row.to_dict()
-        row_dict.update({
-            'ct_avg_price': ct_prices.mean() if not ct_prices.empty else np.nan,
-            'fda_avg_price': fda_prices.mean() if not fda_prices.empty else np.nan
-        })
-        processed_data.append(row_dict)
-
-    # Create processed dataframe
-    processed_df = pd.DataFrame(processed_data)
-    
-    # Calculate percentage change and remove NA rows
-    processed_df['price_pct_change'] = ((processed_df['fda_avg_price'] - processed_df['ct_avg_price']) / 
-                                       processed_df['ct_avg_price'] * 100)
+    # Remove NA rows
     processed_df['profit_or_loss'] = processed_df['fda_avg_price'] - processed_df['ct_avg_price']
     clean_df = processed_df.dropna(subset=['price_pct_change'])
     ROI = round(clean_df['profit_or_loss'].sum() / clean_df['ct_avg_price'].sum(), 2)